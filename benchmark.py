@@ -0,0 +1,501 @@
+import os
+import sys
+import glob
+import json
+import time
+import random
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+RENDER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eml-to-pdf-render.py")
+MERGE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sort-and-merge-pdf.py")
+
+
+def run_render(args: List[str]) -> float:
+    """Run eml-to-pdf-render.py with the given arguments and return wall-clock seconds"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, RENDER_SCRIPT] + args, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def process_tree_rss(pid: int) -> float:
+    """Summed resident memory in MiB of a process and all its descendants, from /proc (Linux only).
+
+    Pages shared between processes, such as Chromium's, are counted once per
+    process, so this is an upper bound on the tree's real footprint.
+    """
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+        pending += children.get(current, [])
+    return total / (1024 * 1024)
+
+
+def run_measured(command: List[str]) -> Tuple[float, float]:
+    """Run a command and return (wall-clock seconds, peak RSS in MiB) of it and every process it starts.
+
+    On Linux the whole process tree, including browsers and worker
+    processes, is sampled every 50 ms. Elsewhere only the command's own
+    peak, as reported by the kernel, is available.
+    """
+    import threading
+
+    sample_tree = os.path.isdir("/proc")
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    finished = threading.Event()
+    sampled_peak = 0.0
+
+    def sample():
+        nonlocal sampled_peak
+        while not finished.is_set():
+            sampled_peak = max(sampled_peak, process_tree_rss(process.pid))
+            finished.wait(0.05)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    if sample_tree:
+        sampler.start()
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - started
+    finished.set()
+    if sample_tree:
+        sampler.join()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / (1024 * 1024)
+    return seconds, max(peak, sampled_peak)
+
+
+EML_PROFILES = ["plain", "html", "tables", "inline-images", "attachments"]
+
+LOREM_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+               "et dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris").split()
+
+
+def random_text(rng: random.Random, size: int) -> List[str]:
+    """Paragraphs of lorem ipsum totalling roughly `size` characters"""
+    paragraphs = []
+    total = 0
+    while total < size:
+        paragraph = " ".join(rng.choice(LOREM_WORDS) for _ in range(rng.randint(20, 80))).capitalize() + "."
+        paragraphs.append(paragraph)
+        total += len(paragraph)
+    return paragraphs
+
+
+def random_png(rng: random.Random, width: int, height: int) -> bytes:
+    """A PNG of coloured stripes, so it neither compresses to nothing nor weighs megabytes"""
+    import io
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 8):
+        draw.rectangle([x, 0, x + 7, height], fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def synthetic_email(rng: random.Random, index: int, profile: str, size: int, thread: List[str], seed: int):
+    """One EmailMessage of the given profile, replying to the last message of `thread` if there is one"""
+    from datetime import datetime, timedelta, timezone
+    from email.message import EmailMessage
+    from email.utils import format_datetime
+
+    message = EmailMessage()
+    message_id = f"<bench-{seed}-{index:06d}@example.com>"
+    subject = f"Benchmark {profile} {index // 7:05d}"
+    message["From"] = f"Sender {index % 13} <sender{index % 13}@example.com>"
+    message["To"] = "Recipient <recipient@example.com>"
+    message["Subject"] = f"Re: {subject}" if thread else subject
+    message["Date"] = format_datetime(datetime(2024, 1, 1, tzinfo=timezone(timedelta(hours=10)))
+                                      + timedelta(minutes=37 * index))
+    message["Message-ID"] = message_id
+    if thread:
+        message["In-Reply-To"] = thread[-1]
+        message["References"] = " ".join(thread[-10:])
+
+    paragraphs = random_text(rng, size)
+    text = "\n\n".join(paragraphs)
+    if profile == "plain":
+        message.set_content(text)
+        return message, message_id
+
+    html = "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+    if profile == "tables":
+        rows = max(10, size // 200)
+        cells = "".join(f"<tr>{''.join(f'<td>{rng.choice(LOREM_WORDS)} {rng.randint(0, 99999)}</td>' for _ in range(6))}</tr>"
+                        for _ in range(rows))
+        html = (f'<table width="600" cellpadding="4" border="1" style="border-collapse:collapse">{cells}</table>'
+                + html)
+    images = []
+    if profile == "inline-images":
+        for n in range(rng.randint(1, 4)):
+            images.append((f"image{n}.{index}@example.com", random_png(rng, rng.randint(80, 600), rng.randint(40, 300))))
+        html = "".join(f'<img src="cid:{cid}" alt="">' for cid, _ in images) + html
+
+    message.set_content(text)
+    message.add_alternative(f"<html><body style=\"font-family:Arial\">{html}</body></html>", subtype="html")
+    if images:
+        html_part = message.get_payload()[1]
+        for cid, data in images:
+            html_part.add_related(data, "image", "png", cid=f"<{cid}>")
+    if profile == "attachments":
+        for n in range(rng.randint(1, 5)):
+            message.add_attachment(rng.randbytes(rng.randint(1024, 256 * 1024)), maintype="application",
+                                   subtype="octet-stream", filename=f"attachment-{n}.bin")
+    return message, message_id
+
+
+def generate_eml_corpus(folder: str, count: int, seed: int = 0, profiles: Optional[List[str]] = None,
+                        min_kb: int = 1, max_kb: int = 64) -> List[str]:
+    """Write a reproducible corpus of `count` synthetic .eml files and return their paths.
+
+    The same seed always produces byte-identical files: every choice comes
+    from one seeded Random, and MIME boundaries are derived from the index
+    instead of being left to the email package. Profiles rotate through
+    `profiles`, body sizes are drawn between min_kb and max_kb, and about
+    half of the messages reply to an earlier thread so that conversation
+    merging has real work to do.
+    """
+    from email import policy
+
+    rng = random.Random(seed)
+    profiles = profiles or EML_PROFILES
+    os.makedirs(folder, exist_ok=True)
+    threads: List[List[str]] = []
+    paths = []
+    for index in range(count):
+        profile = profiles[index % len(profiles)]
+        thread = rng.choice(threads) if threads and rng.random() < 0.5 else []
+        message, message_id = synthetic_email(rng, index, profile, rng.randint(min_kb, max_kb) * 1024, thread, seed)
+        if thread:
+            thread.append(message_id)
+        else:
+            threads.append([message_id])
+        for number, part in enumerate(message.walk()):
+            if part.is_multipart():
+                part.set_boundary(f"=_bench_{seed}_{index}_{number}")
+
+        path = os.path.join(folder, f"Email {index:05d} {message['Date'].datetime.strftime('%Y-%m-%dT%H_%M_%S')}+10_00.eml")
+        with open(path, "wb") as f:
+            f.write(message.as_bytes(policy=policy.SMTP))
+        paths.append(path)
+    return paths
+
+
+def generate_email_pdfs(folder: str, count: int, templates: int = 20, names: Optional[List[str]] = None):
+    """Write `count` email-like PDFs, each a copy of one of `templates` distinct documents.
+
+    `names` gives the file stems to use; by default they are numbered emails.
+    """
+    import io
+    import shutil
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+    from PIL import Image
+
+    logo = io.BytesIO()
+    Image.new("RGB", (300, 80), (30, 90, 160)).save(logo, "PNG")
+
+    template_paths = []
+    for t in range(min(templates, count)):
+        path = os.path.join(folder, f"template {t}.pdf")
+        pdf = canvas.Canvas(path)
+        for page in range(2):
+            pdf.drawImage(ImageReader(io.BytesIO(logo.getvalue())), 72, 720)
+            pdf.setFont("Helvetica", 11)
+            for line in range(40):
+                pdf.drawString(72, 690 - line * 15, f"Template {t}, page {page}, line {line}: lorem ipsum dolor sit amet")
+            pdf.showPage()
+        pdf.save()
+        template_paths.append(path)
+
+    for i in range(count):
+        day = 1 + i % 28
+        name = names[i] if names else f"Email {i:05d} 2024-01-{day:02d}T10_00_00+10_00"
+        shutil.copyfile(template_paths[i % len(template_paths)], os.path.join(folder, f"{name}.pdf"))
+    for path in template_paths:
+        os.unlink(path)
+
+
+def benchmark_merge(counts: List[int], modes: List[str]) -> List[Dict]:
+    """Peak memory and time of sort-and-merge-pdf.py for growing numbers of inputs"""
+    results = []
+    print(f"\n  {'inputs':>7}  {'mode':>9}  {'seconds':>8}  {'peak RSS':>10}  {'output':>10}")
+    for count in counts:
+        with tempfile.TemporaryDirectory() as folder:
+            inputs = os.path.join(folder, "inputs")
+            os.makedirs(inputs)
+            generate_email_pdfs(inputs, count)
+            for mode in modes:
+                output = os.path.join(folder, f"merged-{mode}.pdf")
+                command = [sys.executable, MERGE_SCRIPT, "--input", inputs, "--output", output]
+                if mode == "in-memory":
+                    command.append("--in-memory")
+                seconds, peak = run_measured(command)
+                size = os.path.getsize(output) / (1024 * 1024)
+                results.append({"inputs": count, "mode": mode, "seconds": round(seconds, 2),
+                                "peak_rss_mib": round(peak, 1), "output_mib": round(size, 1)})
+                print(f"  {count:>7}  {mode:>9}  {seconds:>8.2f}  {peak:>6.1f} MiB  {size:>6.1f} MiB")
+    return results
+
+
+def process_counts(max_processes: int) -> List[int]:
+    """1, 2, 4, ... up to and always including max_processes"""
+    counts = []
+    count = 1
+    while count < max_processes:
+        counts.append(count)
+        count *= 2
+    counts.append(max_processes)
+    return counts
+
+
+def count_emails(input_path: str) -> int:
+    """Emails the renderer will find under input_path, using its own recursive discovery"""
+    return sum(1 for _ in load_render_module().iter_email_sources(input_path))
+
+
+def benchmark_scaling(input_path: str, fmt: str, max_processes: int, repeat: int = 1) -> List[Dict]:
+    """Time --engine processes over 1..max_processes cores on the same input folder"""
+    emails = count_emails(input_path)
+    if not emails:
+        raise SystemExit(f"No .eml files found in {input_path}")
+
+    results = []
+    for processes in process_counts(max_processes):
+        runs = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as output_dir:
+                runs.append(run_render([f"--batch-{fmt}", input_path, "--output-dir", output_dir,
+                                        "--engine", "processes", "--processes", str(processes)]))
+        seconds = min(runs)
+        results.append({"processes": processes, "emails": emails, "seconds": round(seconds, 3),
+                        "emails_per_second": round(emails / seconds, 2)})
+
+    baseline = results[0]["seconds"]
+    print(f"\nScaling of --batch-{fmt} --engine processes over {emails} emails:")
+    print(f"  {'processes':>9}  {'seconds':>8}  {'emails/s':>8}  {'speedup':>7}  {'efficiency':>10}")
+    for result in results:
+        result["speedup"] = round(baseline / result["seconds"], 2)
+        result["efficiency"] = round(result["speedup"] / result["processes"], 2)
+        print(f"  {result['processes']:>9}  {result['seconds']:>8.2f}  {result['emails_per_second']:>8.2f}  "
+              f"{result['speedup']:>6.2f}x  {result['efficiency']:>10.0%}")
+    return results
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50, p95 and p99 of `samples`"""
+    ordered = sorted(samples)
+    result = {}
+    for p in (50, 95, 99):
+        rank = max(1, -(-p * len(ordered) // 100))
+        result[f"p{p}"] = round(ordered[rank - 1], 6)
+    return result
+
+
+def load_render_module():
+    """Import eml-to-pdf-render.py, whose name is not a valid module name"""
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("eml_to_pdf_render", RENDER_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def benchmark_extract(eml_files: List[str], repeat: int = 1) -> Dict:
+    """Per-email latency of extract_html_from_eml, measured in this process"""
+    import resource
+
+    render = load_render_module()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for eml_file in eml_files:
+            call_started = time.perf_counter()
+            render.extract_html_from_eml(eml_file)
+            latencies.append(time.perf_counter() - call_started)
+    seconds = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / 1024 if sys.platform != "darwin" else peak / (1024 * 1024)
+    return {"stage": "extract_html_from_eml", "workers": 1, "emails": len(latencies), "seconds": round(seconds, 3),
+            "emails_per_second": round(len(latencies) / seconds, 2), "latency_seconds": percentiles(latencies),
+            "peak_rss_mib": round(peak, 1)}
+
+
+def benchmark_batch(corpus: str, emails: int, fmt: str, workers: int, repeat: int, engine: str) -> Dict:
+    """Time one --batch-<fmt> run per repeat at the given worker count.
+
+    Per-email latencies come from the 'email' spans the converter writes
+    with --spans, across all repeats. `outputs` counts the files written,
+    which exposes runs in which conversions failed.
+    """
+    runs = []
+    peaks = []
+    latencies = []
+    outputs = 0
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as output_dir:
+            spans_path = os.path.join(output_dir, "spans.jsonl")
+            command = [sys.executable, RENDER_SCRIPT, f"--batch-{fmt}", corpus, "--output-dir", output_dir,
+                       "--engine", engine, "--spans", spans_path]
+            command += ["--processes", str(workers)] if engine == "processes" else ["--workers", str(workers)]
+            seconds, peak = run_measured(command)
+            outputs = len(glob.glob(os.path.join(output_dir, "**", f"*.{fmt}"), recursive=True))
+            if os.path.exists(spans_path):
+                with open(spans_path, encoding="utf-8") as f:
+                    latencies += [span["seconds"] for span in map(json.loads, f) if span["stage"] == "email"]
+        runs.append(seconds)
+        peaks.append(peak)
+    seconds = min(runs)
+    return {"stage": f"batch-{fmt}", "engine": engine, "workers": workers, "emails": emails, "outputs": outputs,
+            "seconds": round(seconds, 3), "emails_per_second": round(emails / seconds, 2),
+            "latency_seconds": percentiles(latencies or [run / emails for run in runs]),
+            "peak_rss_mib": round(max(peaks), 1)}
+
+
+def benchmark_merge_pdfs(pdf_folder: str, eml_folder: str, pdfs: int, workers: List[int], repeat: int) -> List[Dict]:
+    """Time PDFSorterMerger.merge_pdfs, then the per-conversation merge at each worker count"""
+    variants = [("merge_pdfs", 1, [])]
+    variants += [("merge_conversations", count, ["--eml-dir", eml_folder, "--per-conversation", "--workers", str(count)])
+                 for count in workers]
+    results = []
+    for stage, count, extra in variants:
+        runs = []
+        peaks = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as output_dir:
+                output = os.path.join(output_dir, "merged.pdf" if stage == "merge_pdfs" else "conversations")
+                seconds, peak = run_measured([sys.executable, MERGE_SCRIPT, "--input", pdf_folder, "--output", output]
+                                             + extra)
+            runs.append(seconds)
+            peaks.append(peak)
+        seconds = min(runs)
+        results.append({"stage": stage, "workers": count, "pdfs": pdfs, "seconds": round(seconds, 3),
+                        "pdfs_per_second": round(pdfs / seconds, 2), "latency_seconds": percentiles(runs),
+                        "peak_rss_mib": round(max(peaks), 1)})
+    return results
+
+
+def benchmark_suite(count: int, seed: int, workers: List[int], formats: List[str], repeat: int = 1,
+                    engine: str = "threads", input_path: Optional[str] = None) -> Dict:
+    """Run every benchmark stage over a synthetic corpus (or `input_path`) and return a JSON-ready report"""
+    import platform
+
+    with tempfile.TemporaryDirectory() as folder:
+        if input_path:
+            corpus = input_path
+            eml_files = list(load_render_module().iter_email_sources(corpus))
+            if not eml_files:
+                raise SystemExit(f"No .eml files found in {input_path}")
+        else:
+            corpus = os.path.join(folder, "corpus")
+            eml_files = generate_eml_corpus(corpus, count, seed)
+
+        results = [benchmark_extract(eml_files, repeat)]
+        for fmt in formats:
+            for count_workers in workers:
+                results.append(benchmark_batch(corpus, len(eml_files), fmt, count_workers, repeat, engine))
+
+        pdf_folder = os.path.join(folder, "pdfs")
+        os.makedirs(pdf_folder)
+        generate_email_pdfs(pdf_folder, len(eml_files),
+                            names=[os.path.splitext(os.path.basename(path))[0] for path in eml_files])
+        results += benchmark_merge_pdfs(pdf_folder, corpus, len(eml_files), workers, repeat)
+
+    print(f"\n  {'stage':<22} {'workers':>7}  {'seconds':>8}  {'items/s':>8}  {'p50':>9}  {'p95':>9}  {'p99':>9}  {'peak RSS':>10}")
+    for result in results:
+        latency = result["latency_seconds"]
+        rate = result.get("emails_per_second", result.get("pdfs_per_second"))
+        print(f"  {result['stage']:<22} {result['workers']:>7}  {result['seconds']:>8.2f}  {rate:>8.2f}  "
+              f"{latency['p50']:>9.4f}  {latency['p95']:>9.4f}  {latency['p99']:>9.4f}  {result['peak_rss_mib']:>6.1f} MiB")
+
+    return {"environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count()},
+            "corpus": {"path": input_path, "emails": len(eml_files), "seed": None if input_path else seed},
+            "repeat": repeat, "engine": engine, "results": results}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks for the EML converter.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scaling = subparsers.add_parser("scaling", help="Measure multi-process batch scaling from 1 to N cores")
+    scaling.add_argument("--input", required=True, help="Folder of .eml files to render")
+    scaling.add_argument("--format", choices=["pdf", "png"], default="pdf", help="Output format (default: pdf)")
+    scaling.add_argument("--max-processes", type=int, default=os.cpu_count() or 1,
+                         help="Highest process count to try (default: CPU count)")
+    scaling.add_argument("--repeat", type=int, default=1, help="Runs per process count; the fastest is kept")
+    scaling.add_argument("--json", help="Also write the results to this JSON file")
+
+    merge = subparsers.add_parser("merge", help="Measure peak memory of PDF merging as the input count grows")
+    merge.add_argument("--counts", default="10,1000,10000", help="Comma-separated input counts (default: 10,1000,10000)")
+    merge.add_argument("--modes", default="streaming,in-memory",
+                       help="Comma-separated merge modes to compare (default: streaming,in-memory)")
+    merge.add_argument("--json", help="Also write the results to this JSON file")
+
+    corpus = subparsers.add_parser("corpus", help="Write a reproducible synthetic .eml corpus")
+    corpus.add_argument("--output", required=True, help="Folder to write the .eml files to")
+    corpus.add_argument("--count", type=int, default=100, help="Number of emails (default: 100)")
+    corpus.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives identical files")
+    corpus.add_argument("--profiles", default=",".join(EML_PROFILES),
+                        help=f"Comma-separated email profiles to rotate through (default: {','.join(EML_PROFILES)})")
+    corpus.add_argument("--min-kb", type=int, default=1, help="Smallest body size in KiB (default: 1)")
+    corpus.add_argument("--max-kb", type=int, default=64, help="Largest body size in KiB (default: 64)")
+
+    suite = subparsers.add_parser("suite", help="Time extraction, batch conversion and merging across worker counts")
+    suite.add_argument("--input", help="Folder of .eml files to use instead of a synthetic corpus")
+    suite.add_argument("--count", type=int, default=50, help="Emails in the synthetic corpus (default: 50)")
+    suite.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus (default: 0)")
+    suite.add_argument("--workers", default="1,4", help="Comma-separated worker counts to try (default: 1,4)")
+    suite.add_argument("--formats", default="html,pdf,png",
+                       help="Comma-separated batch formats to time (default: html,pdf,png)")
+    suite.add_argument("--engine", choices=["threads", "async", "processes"], default="threads",
+                       help="Batch engine to time (default: threads)")
+    suite.add_argument("--repeat", type=int, default=1, help="Runs per measurement (default: 1)")
+    suite.add_argument("--json", help="Also write the report to this JSON file")
+
+    args = parser.parse_args()
+    if args.command == "scaling":
+        results = benchmark_scaling(args.input, args.format, args.max_processes, args.repeat)
+    elif args.command == "merge":
+        results = benchmark_merge([int(count) for count in args.counts.split(",")], args.modes.split(","))
+    elif args.command == "corpus":
+        paths = generate_eml_corpus(args.output, args.count, args.seed, args.profiles.split(","), args.min_kb, args.max_kb)
+        print(f"Wrote {len(paths)} emails to {args.output}")
+        sys.exit(0)
+    elif args.command == "suite":
+        results = benchmark_suite(args.count, args.seed, [int(count) for count in args.workers.split(",")],
+                                  args.formats.split(","), args.repeat, args.engine, args.input)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
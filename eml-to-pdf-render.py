@@ -1,606 +1,3583 @@
 import sys
 import os
 import glob
-from email import policy
-from email.parser import BytesParser
+import json
+import re
+
+# Files at least this large are parsed through a read-only memory map instead
+# of being read into memory in one go
+MMAP_THRESHOLD = 1024 * 1024
+
+class MimePart:
+    """A leaf MIME part located by offsets inside a message buffer.
+
+    Only the part's headers are parsed up front. The body stays in the buffer
+    (often a memory map) until get_payload() is called, so attachment bodies
+    that are never rendered are never copied or decoded.
+    """
+
+    def __init__(self, buffer, headers, body_start, body_end):
+        self.buffer = buffer
+        self.headers = headers
+        self.body_start = body_start
+        self.body_end = body_end
+
+    def get_content_type(self):
+        return self.headers.get_content_type()
+
+    def get_payload(self):
+        """Return the body bytes with the Content-Transfer-Encoding removed"""
+        import base64
+        import binascii
+
+        body = self.buffer[self.body_start:self.body_end]
+        encoding = str(self.headers.get('Content-Transfer-Encoding', '')).strip().lower()
+        if encoding == 'base64':
+            return base64.b64decode(body, validate=False)
+        if encoding == 'quoted-printable':
+            return binascii.a2b_qp(body)
+        return body
+
+    def get_text(self):
+        """Return the decoded body as text using the part's declared charset"""
+        charset = self.headers.get_content_charset() or 'utf-8'
+        try:
+            return self.get_payload().decode(charset, errors='ignore')
+        except LookupError:
+            return self.get_payload().decode('utf-8', errors='ignore')
+
+def find_header_end(buffer, start, end):
+    """Return (headers_end, body_start) for the entity that begins at start"""
+    # An entity with no headers starts directly with its blank line
+    for blank in (b'\r\n', b'\n'):
+        if buffer[start:start + len(blank)] == blank:
+            return start, start + len(blank)
+
+    candidates = []
+    for separator in (b'\r\n\r\n', b'\n\n'):
+        position = buffer.find(separator, start, end)
+        if position != -1:
+            candidates.append((position, position + len(separator)))
+    return min(candidates) if candidates else (end, end)
+
+def iter_mime_parts(buffer, start=0, end=None):
+    """Lazily walk the MIME tree in buffer[start:end], yielding leaf MimeParts.
+
+    Only headers are parsed while walking. Multipart bodies are split by
+    searching for boundary delimiters, which skips over attachment bodies
+    without copying them. Parts are yielded in the same order as
+    email.message.Message.walk().
+    """
+    from email import policy
+    from email.parser import BytesHeaderParser
+
+    if end is None:
+        end = len(buffer)
+
+    headers_end, body_start = find_header_end(buffer, start, end)
+    headers = BytesHeaderParser(policy=policy.default).parsebytes(bytes(buffer[start:headers_end]))
+    content_type = headers.get_content_type()
+
+    if content_type == 'message/rfc822':
+        # Attached messages are walked like email.message.Message.walk() does
+        yield from iter_mime_parts(buffer, body_start, end)
+        return
+
+    boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+    if not boundary:
+        yield MimePart(buffer, headers, body_start, end)
+        return
+
+    delimiter = b'--' + boundary.encode('ascii', errors='ignore')
+    part_start = None
+    position = body_start
+    while True:
+        position = buffer.find(delimiter, position, end)
+        if position == -1:
+            break
+        # Delimiters only count at the start of a line
+        if position != body_start and buffer[position - 1:position] != b'\n':
+            position += len(delimiter)
+            continue
+
+        if part_start is not None:
+            # The line break before a delimiter belongs to the delimiter
+            part_end = position - 1
+            if buffer[part_end - 1:part_end] == b'\r':
+                part_end -= 1
+            yield from iter_mime_parts(buffer, part_start, max(part_start, part_end))
+
+        after = position + len(delimiter)
+        if buffer[after:after + 2] == b'--':
+            return
+        line_end = buffer.find(b'\n', after, end)
+        if line_end == -1:
+            return
+        part_start = line_end + 1
+        position = part_start
+
+    # Tolerate a missing close delimiter by treating the rest as the last part
+    if part_start is not None and part_start < end:
+        yield from iter_mime_parts(buffer, part_start, end)
+
+class ArchivedEmail(str):
+    """An email stored inside an mbox, Maildir, zip or tar archive.
+
+    The string value is a virtual path, <archive>/<name>.eml, which the rest
+    of the pipeline uses for progress output, output names and the journal
+    exactly like a real .eml path. The message bytes are only read when the
+    email is parsed. Instances pickle to a handful of fields, so they reach
+    worker processes just as paths do.
+    """
+
+    def __new__(cls, name, archive, kind, location=None, size=None, data=None):
+        self = super().__new__(cls, name)
+        # Archive file (or Maildir message file) the bytes come from
+        self.archive = archive
+        # 'mbox', 'zip', 'tar', 'file' or 'bytes'
+        self.kind = kind
+        # Byte offset for mbox and tar, member name for zip
+        self.location = location
+        self.size = size
+        # Message bytes, for archives that cannot be re-read cheaply
+        self.data = data
+        return self
+
+    def __reduce__(self):
+        return (ArchivedEmail, (str(self), self.archive, self.kind, self.location, self.size, self.data))
+
+    def read_bytes(self):
+        """Read the raw message"""
+        if self.kind == 'bytes':
+            return self.data
+        if self.kind == 'zip':
+            return open_zip_archive(self.archive).read(self.location)
+        with open(self.archive, 'rb') as f:
+            if self.kind == 'file':
+                return f.read()
+            f.seek(self.location)
+            data = f.read(self.size)
+        if self.kind == 'mbox' and b'>From ' in data:
+            # mboxrd escapes body lines starting with "From " as ">From "
+            data = re.sub(rb'(?m)^>(>*From )', rb'\1', data)
+        return data
+
+_zip_archives = {}
+
+def open_zip_archive(path):
+    """A ZipFile kept open per process, so its central directory is read only once"""
+    import zipfile
+
+    key = (os.getpid(), path)
+    archive = _zip_archives.get(key)
+    if archive is None:
+        archive = _zip_archives.setdefault(key, zipfile.ZipFile(path))
+    return archive
+
+class open_message_buffer:
+    """Context manager giving read access to an .eml file's bytes.
+
+    Large files are memory-mapped so that only the pages actually touched
+    while parsing are read from disk. Emails inside archives are read into
+    memory on their own.
+    """
+
+    def __init__(self, eml_file):
+        self.eml_file = eml_file
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        import mmap
+
+        if isinstance(self.eml_file, ArchivedEmail):
+            return self.eml_file.read_bytes()
+        self._file = open(self.eml_file, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+        return self._file.read()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
 
 def extract_html_from_eml(eml_file):
     """Extract HTML content from .eml file"""
-    with open(eml_file, 'rb') as f:
-        msg = BytesParser(policy=policy.default).parse(f)
-    
-    html_content = ""
-    if msg.is_multipart():
-        for part in msg.walk():
+    with open_message_buffer(eml_file) as buffer:
+        for part in iter_mime_parts(buffer):
             if part.get_content_type() == 'text/html':
-                html_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
+                return part.get_text()
+    return ""
+
+class EmailContent:
+    """Everything a page needs to render one email, served from memory.
+
+    `html` is the email's HTML with cid: references rewritten to URLs under
+    EMAIL_ORIGIN. `resources` maps absolute URLs to (content_type, bytes) for
+    the inline parts the HTML refers to, by Content-ID or Content-Location.
+    For emails with only a text/plain body, `text` holds that body and `html`
+    is a minimal page wrapping it.
+    """
+
+    def __init__(self, html, resources=None, source_html=None, text=None):
+        self.html = html
+        self.resources = resources or {}
+        # The HTML exactly as it appears in the email, for .html output
+        self.source_html = html if source_html is None else source_html
+        self.text = text
+        self._document = html.encode('utf-8')
+
+    def external_urls(self):
+        """Resource URLs outside EMAIL_ORIGIN, e.g. absolute Content-Locations"""
+        return [url for url in self.resources if not url.startswith(EMAIL_ORIGIN + '/')]
+
+    def response_for(self, url):
+        """Build the route.fulfill() arguments for a request the page made"""
+        from urllib.parse import unquote
+
+        url = unquote(url.split('#')[0])
+        if url == EMAIL_URL:
+            return {'status': 200, 'content_type': 'text/html; charset=utf-8', 'body': self._document}
+        if url in self.resources:
+            content_type, body = self.resources[url]
+            return {'status': 200, 'content_type': content_type, 'body': body}
+        return {'status': 404, 'body': b''}
+
+def plain_text_to_html(text):
+    """Wrap a text/plain body in a minimal page for the browser and .html output"""
+    from html import escape
+
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>'
+            '<pre style="white-space: pre-wrap; font-family: Arial, Helvetica, sans-serif; font-size: 14px">'
+            f'{escape(text)}</pre></body></html>')
+
+# Matches cid: URLs in attribute values (src="cid:..", src=cid:..) and CSS url(cid:..)
+CID_REFERENCE_PATTERN = re.compile(r'(?i)(?<=["\'(=])\s*cid:')
+# Matches URLs in src/href/background/poster attributes and CSS url(..), for rebasing Content-Location references
+URL_REFERENCE_PATTERN = re.compile(r'''(?i)((?<=\s)(?:src|href|background|poster)\s*=\s*["']?|url\(\s*["']?)([^"'\s()<>]+)''')
+
+def extract_email_content(eml_file, resource_prefix=''):
+    """Extract the HTML part of an .eml file together with its inline resources.
+
+    cid: images are served under EMAIL_ORIGIN + resource_prefix + '/cid/', so
+    several emails can share one page without their Content-IDs colliding.
+    With a resource_prefix, Content-Location parts are served under it too,
+    and the HTML's references to them are rewritten to match.
+    """
+    from html import unescape
+    from urllib.parse import quote, unquote, urljoin
+
+    with open_message_buffer(eml_file) as buffer:
+        html_part = None
+        text_part = None
+        inline_parts = []
+        for part in iter_mime_parts(buffer):
+            if html_part is None and part.get_content_type() == 'text/html':
+                html_part = part
+            elif 'Content-ID' in part.headers or 'Content-Location' in part.headers:
+                inline_parts.append(part)
+            elif (text_part is None and part.get_content_type() == 'text/plain'
+                  and part.headers.get_content_disposition() != 'attachment'):
+                text_part = part
+
+        if html_part is None:
+            if text_part is None:
+                return EmailContent("")
+            text = text_part.get_text()
+            return EmailContent(plain_text_to_html(text), text=text)
+
+        html = html_part.get_text()
+        resources = {}
+        # Where each Content-Location the HTML resolves to is served, when namespaced
+        rebased = {}
+        for part in inline_parts:
+            # Only decode parts the HTML actually refers to
+            urls = []
+            content_id = str(part.headers.get('Content-ID', '')).strip().strip('<>')
+            if content_id and f'cid:{content_id}'.lower() in html.lower():
+                urls.append(f'{EMAIL_ORIGIN}{resource_prefix}/cid/{content_id}')
+            location = str(part.headers.get('Content-Location', '')).strip()
+            if location:
+                url = unquote(urljoin(EMAIL_URL, location))
+                if resource_prefix:
+                    if url.startswith(EMAIL_ORIGIN + '/'):
+                        served = urljoin(f'{EMAIL_ORIGIN}{resource_prefix}/email.html', location)
+                    else:
+                        served = f'{EMAIL_ORIGIN}{resource_prefix}/location/{quote(url, safe="")}'
+                    rebased.setdefault(url, served)
+                    url = unquote(served)
+                urls.append(url)
+            if urls:
+                payload = part.get_payload()
+                for url in urls:
+                    resources.setdefault(url, (part.get_content_type(), payload))
+
+    rendered_html = CID_REFERENCE_PATTERN.sub(f'{EMAIL_ORIGIN}{resource_prefix}/cid/', html)
+    if rebased:
+        def rebase(match):
+            url = unquote(urljoin(EMAIL_URL, unescape(match.group(2))))
+            return match.group(1) + rebased.get(url, match.group(2))
+
+        rendered_html = URL_REFERENCE_PATTERN.sub(rebase, rendered_html)
+    return EmailContent(rendered_html, resources, html)
+
+def extract_email_headers(eml_file):
+    """Parse only the top-level headers of an .eml file"""
+    from email import policy
+    from email.parser import BytesHeaderParser
+
+    with open_message_buffer(eml_file) as buffer:
+        headers_end, _ = find_header_end(buffer, 0, len(buffer))
+        return BytesHeaderParser(policy=policy.default).parsebytes(bytes(buffer[:headers_end]))
+
+def get_email_date(headers):
+    """Parse the Date header into an aware datetime, or None if missing or invalid"""
+    from email.utils import parsedate_to_datetime
+
+    try:
+        date = parsedate_to_datetime(str(headers.get('Date', '')))
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is not None and date.tzinfo is None:
+        import datetime
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+def is_maildir(path):
+    """A Maildir is a folder with cur/ and new/ subfolders"""
+    return os.path.isdir(os.path.join(path, 'cur')) and os.path.isdir(os.path.join(path, 'new'))
+
+def is_mbox(path):
+    """An mbox file by name, or any file but an .eml starting with a "From " envelope line.
+
+    Single messages saved with their envelope line are .eml files too, so
+    those are never treated as mailboxes.
+    """
+    if not os.path.isfile(path):
+        return False
+    if path.lower().endswith(('.mbox', '.mbx')) or os.path.basename(path).lower() == 'mbox':
+        return True
+    if path.lower().endswith('.eml'):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(5) == b'From '
+
+def is_zip_archive(path):
+    return os.path.isfile(path) and path.lower().endswith('.zip')
+
+def is_tar_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(TAR_SUFFIXES)
+
+def iter_mbox_messages(path):
+    """Yield each message of an mbox file by its byte range, scanning a memory map"""
+    import mmap
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            index = 0
+            separator = 0 if buffer[:5] == b'From ' else buffer.find(b'\nFrom ')
+            while separator != -1:
+                # Skip the "From sender date" envelope line, which is not part of the message
+                if buffer[separator] == ord('\n'):
+                    separator += 1
+                start = buffer.find(b'\n', separator)
+                if start == -1:
+                    break
+                start += 1
+                separator = buffer.find(b'\nFrom ', start)
+                end = len(buffer) if separator == -1 else separator + 1
+                index += 1
+                yield ArchivedEmail(f'{path}/{index:06d}.eml', path, 'mbox', start, end - start)
+
+def iter_maildir_messages(path):
+    """Yield every message in a Maildir's new/ and cur/ folders"""
+    for folder in ('new', 'cur'):
+        for name in sorted(os.listdir(os.path.join(path, folder))):
+            message_path = os.path.join(path, folder, name)
+            if name.startswith('.') or not os.path.isfile(message_path):
+                continue
+            # Drop the ":2,FLAGS" info suffix, which is not a valid filename on every OS.
+            # The key stays the same when a message moves from new/ to cur/
+            key = name.split(':')[0].split('!')[0]
+            yield ArchivedEmail(f'{path}/{key}.eml', message_path, 'file')
+
+def iter_zip_messages(path):
+    """Yield the .eml members of a zip archive without extracting them"""
+    import zipfile
+
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith('.eml'):
+                yield ArchivedEmail(f'{path}/{info.filename}', path, 'zip', info.filename, info.file_size)
+
+def iter_tar_messages(path):
+    """Yield the .eml members of a tar archive, reading it as a single stream.
+
+    Members of an uncompressed tar are read later by offset. A compressed
+    stream cannot be seeked cheaply, so those members carry their bytes.
+    """
+    import tarfile
+
+    compressed = not path.lower().endswith('.tar')
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith('.eml'):
+                name = f'{path}/{member.name}'
+                if compressed:
+                    yield ArchivedEmail(name, path, 'bytes', data=archive.extractfile(member).read())
+                else:
+                    yield ArchivedEmail(name, path, 'tar', member.offset_data, member.size)
+            # A streamed TarFile remembers every member it has seen; forget them
+            archive.members = []
+
+def is_archive_name(path):
+    """Archives picked up while walking a folder tree, recognised by name alone"""
+    return path.lower().endswith(('.zip', '.mbox', '.mbx') + TAR_SUFFIXES)
+
+def walk_email_sources(folder_path):
+    """Recursively yield the emails under a folder as they are found.
+
+    One os.scandir() listing is held at a time, so memory depends on the
+    largest folder, not on the size of the tree. Files come before
+    subfolders, each in name order. Archives and Maildirs in the tree are
+    expanded in place. Hidden entries, such as cache folders, are skipped.
+    """
+    try:
+        with os.scandir(folder_path) as scan:
+            entries = sorted(scan, key=lambda entry: entry.name)
+    except OSError as e:
+        print(f"Warning: cannot read {folder_path}: {e}")
+        return
+
+    subfolders = []
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            subfolders.append(entry.path)
+        elif entry.name.lower().endswith('.eml'):
+            yield entry.path
+        elif is_archive_name(entry.name) and entry.is_file():
+            yield from iter_email_sources(entry.path)
+    del entries
+
+    for subfolder in subfolders:
+        if is_maildir(subfolder):
+            yield from iter_maildir_messages(subfolder)
+        else:
+            yield from walk_email_sources(subfolder)
+
+def iter_eml_files(path):
+    """Yield a single .eml file, or every .eml file under a folder"""
+    if os.path.isfile(path):
+        if path.lower().endswith('.eml'):
+            yield path
+        return
+    yield from walk_email_sources(path)
+
+# Input sources, tried in order: (test for the input path, message iterator).
+# Append to this list to support another mailbox format.
+INPUT_SOURCES = [
+    (is_maildir, iter_maildir_messages),
+    (is_zip_archive, iter_zip_messages),
+    (is_tar_archive, iter_tar_messages),
+    (is_mbox, iter_mbox_messages),
+]
+
+def iter_email_sources(path):
+    """Lazily yield every email under an input path: .eml files, folder trees, Maildir, mbox, zip or tar"""
+    for matches, iterate in INPUT_SOURCES:
+        if matches(path):
+            yield from iterate(path)
+            return
+    yield from iter_eml_files(path)
+
+def get_eml_files_from_folder(folder_path):
+    """Get all emails from a folder, .eml file or mailbox archive"""
+    return list(iter_email_sources(folder_path))
+
+def batch_convert_to_html(folder_path, dark_mode=False, output_dir=None, options=None):
+    """Convert all .eml files under a folder to HTML, mirroring its layout"""
+    deduplicator = Deduplicator() if options is not None and options.dedup else None
+    eml_files = discover_emails(folder_path, ['.html'], options, deduplicator, output_dir)
+    
+    print(f"Converting emails under {folder_path} to HTML")
+    converted_files = []
+    count = 0
+    
+    for count, eml_file in enumerate(eml_files, 1):
+        print(f"Processing {count}: {os.path.basename(eml_file)}")
+        try:
+            with stage_span(options, eml_file, 'email'):
+                result = convert_to_html(eml_file, dark_mode, mirrored_output_dir(eml_file, folder_path, output_dir))
+        except Exception as e:
+            print(f"Error processing {os.path.basename(eml_file)}: {e}")
+            record_in_journal(options, eml_file, ['.html'], error=str(e))
+            continue
+        record_in_journal(options, eml_file, ['.html'], [result] if result else [])
+        if result:
+            converted_files.append(result)
+    
+    converted_files += finish_deduplication(deduplicator, ['.html'], folder_path, output_dir, options)
+    if not count:
+        print(f"No .eml files to convert in {folder_path}")
+        return []
+    print(f"Successfully converted {len(converted_files)} files to HTML")
+    return converted_files
+
+def format_label(extensions):
+    """'PDF' for ['.pdf'], 'HTML/PDF/PNG' for several formats"""
+    return '/'.join(extension.lstrip('.').upper() for extension in extensions)
+
+def archive_output_folder(archive):
+    """Folder for the outputs of an archive's emails: its name without the archive suffix"""
+    lower = archive.lower()
+    for suffix in TAR_SUFFIXES + ('.zip', '.mbox', '.mbx'):
+        if lower.endswith(suffix):
+            return archive[:-len(suffix)]
+    # Never the archive's own path, which is a file
+    return archive + '-messages'
+
+def mirrored_output_dir(eml_file, root, output_dir=None):
+    """The output folder for an email, mirroring where it sits under the input root.
+
+    Emails inside an mbox, zip or tar archive in the tree go into a folder
+    named after the archive, see archive_output_folder.
+    """
+    directory = os.path.dirname(eml_file)
+    archive = getattr(eml_file, 'archive', None)
+    if (archive and archive != root and getattr(eml_file, 'kind', None) != 'file'
+            and eml_file.startswith(archive + '/')):
+        directory = os.path.join(archive_output_folder(archive), os.path.dirname(eml_file[len(archive) + 1:]))
+    relative = os.path.relpath(directory, root) if eml_file != root else '.'
+    if relative == '.' or relative.startswith('..'):
+        return output_dir
+    return os.path.join(output_dir, relative) if output_dir else relative
+
+class Deduplicator:
+    """Spots repeated copies of a message while emails are being discovered.
+
+    Two files are the same message when they share a Message-ID, or when
+    their raw bodies match after MIME boundaries and whitespace are removed.
+    That catches re-exported copies whose only difference is freshly
+    generated boundaries. Only the first copy is passed on to be rendered.
+    The others are remembered, so that their outputs can be linked to the
+    first copy's once the batch is done. Memory grows with the number of
+    unique messages: two short digests each.
+    """
+
+    BOUNDARY_PATTERN = re.compile(rb'(?i)boundary\s*=\s*"?([^";\s]+)')
+    WHITESPACE_PATTERN = re.compile(rb'\s+')
+
+    def __init__(self):
+        self._by_message_id = {}
+        self._by_body = {}
+        # (duplicate, original, 'message-id' or 'body')
+        self.duplicates = []
+
+    def fingerprint(self, eml_file):
+        """(normalised Message-ID or None, SHA-256 of the normalised raw body)"""
+        import hashlib
+        from email import policy
+        from email.parser import BytesHeaderParser
+
+        with open_message_buffer(eml_file) as buffer:
+            headers_end, body_start = find_header_end(buffer, 0, len(buffer))
+            header_bytes = bytes(buffer[:headers_end])
+            body = bytes(buffer[body_start:])
+
+        headers = BytesHeaderParser(policy=policy.compat32).parsebytes(header_bytes)
+        message_id = str(headers.get('Message-ID', '')).strip().strip('<>').lower() or None
+        for boundary in set(self.BOUNDARY_PATTERN.findall(header_bytes + body)):
+            body = body.replace(boundary, b'')
+        return message_id, hashlib.sha256(self.WHITESPACE_PATTERN.sub(b'', body)).digest()
+
+    def filter(self, eml_files):
+        """Yield the first copy of every message, noting the rest as duplicates"""
+        for eml_file in eml_files:
+            try:
+                message_id, body_digest = self.fingerprint(eml_file)
+            except Exception as e:
+                print(f"Warning: cannot fingerprint {os.path.basename(eml_file)}: {e}")
+                yield eml_file
+                continue
+
+            original = self._by_message_id.get(message_id) if message_id else None
+            reason = 'message-id'
+            if original is None:
+                original = self._by_body.get(body_digest)
+                reason = 'body'
+            if original is not None:
+                print(f"Duplicate: {os.path.basename(eml_file)} is a copy of {os.path.basename(original)} "
+                      f"(same {reason})")
+                self.duplicates.append((eml_file, original, reason))
+                continue
+
+            if message_id:
+                self._by_message_id[message_id] = eml_file
+            self._by_body[body_digest] = eml_file
+            yield eml_file
+
+def discover_emails(folder_path, extensions, options=None, deduplicator=None, output_dir=None):
+    """The lazy stream of emails a batch should convert: discovered, deduplicated, then resumed"""
+    eml_files = iter_email_sources(folder_path)
+    if deduplicator is not None:
+        eml_files = deduplicator.filter(eml_files)
+    return resume_from_journal(eml_files, extensions, options, folder_path, output_dir)
+
+def find_outputs(eml_file, extension, output_dir=None, options=None):
+    """The existing output files of one format for an email.
+
+    '.png' stands for the screenshot in whatever --image-format was chosen,
+    either one image or the numbered tiles of a tall page.
+    """
+    if extension != '.png':
+        path = get_output_path(eml_file, extension, output_dir)
+        return [path] if os.path.exists(path) else []
+    path = get_output_path(eml_file, image_extension(options), output_dir)
+    if os.path.exists(path):
+        return [path]
+    stem = get_output_path(eml_file, '', output_dir)
+    return sorted(glob.glob(f"{glob.escape(stem)}-[0-9][0-9][0-9]{image_extension(options)}"))
+
+def link_atomic(source, destination):
+    """Hard-link (or copy) source to destination through a temp name and os.replace()"""
+    import shutil
+    import uuid
+
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    temp_path = os.path.join(os.path.dirname(destination), f'.tmp-{uuid.uuid4().hex}')
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    except:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def finish_deduplication(deduplicator, extensions, folder_path, output_dir=None, options=None):
+    """Give each duplicate its original's outputs and write duplicates.csv.
+
+    Outputs are hard-linked, or copied across filesystems. Returns the files
+    created.
+    """
+    import csv
+
+    if deduplicator is None or not deduplicator.duplicates:
+        return []
+
+    linked = []
+    report_path = os.path.join(output_dir or '.', 'duplicates.csv')
+    os.makedirs(output_dir or '.', exist_ok=True)
+    with atomic_output(report_path) as temp_path:
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            report = csv.writer(f)
+            report.writerow(['duplicate', 'original', 'matched_by', 'outputs'])
+            for duplicate, original, reason in deduplicator.duplicates:
+                outputs = []
+                original_stem = os.path.basename(get_output_path(original, ''))
+                sources = [source for extension in extensions for source in
+                           find_outputs(original, extension, mirrored_output_dir(original, folder_path, output_dir),
+                                        options)]
+                for source in sources:
+                    # Keep the format's suffix, e.g. '.pdf' or a tile's '-002.jpg'
+                    suffix = os.path.basename(source)[len(original_stem):]
+                    destination = get_output_path(duplicate, suffix,
+                                                  mirrored_output_dir(duplicate, folder_path, output_dir))
+                    try:
+                        link_atomic(source, destination)
+                    except OSError as e:
+                        print(f"Warning: could not link {destination}: {e}")
+                        continue
+                    outputs.append(destination)
+                record_in_journal(options, duplicate, extensions, outputs)
+                linked += outputs
+                report.writerow([duplicate, original, reason, ' '.join(outputs)])
+
+    print(f"Skipped {len(deduplicator.duplicates)} duplicate emails and linked {len(linked)} outputs to "
+          f"their originals; see {report_path}")
+    return linked
+
+def resume_from_journal(eml_files, extensions, options=None, root=None, output_dir=None):
+    """When resuming, lazily drop the emails the journal records as done or as failed too often.
+
+    With root given, an email recorded as done is only skipped if every
+    requested format still has its outputs under the mirrored output folder.
+    """
+    journal = options.journal if options else None
+    if journal is None or not journal.resume:
+        yield from eml_files
+        return
+    print(f"Resuming from {journal.path}")
+    done = exhausted = 0
+    for eml_file in eml_files:
+        status = journal.status(eml_file, extensions)
+        if status == 'done' and root is not None:
+            email_output_dir = mirrored_output_dir(eml_file, root, output_dir)
+            if not all(find_outputs(eml_file, extension, email_output_dir, options) for extension in extensions):
+                status = 'pending'
+        if status == 'done':
+            done += 1
+        elif status == 'exhausted':
+            exhausted += 1
+            print(f"  Skipping {os.path.basename(eml_file)}: failed {journal.max_attempts} times")
+        else:
+            yield eml_file
+    print(f"Resume skipped {done} finished and {exhausted} failed emails")
+
+def record_in_journal(options, eml_file, extensions, outputs=None, error=None):
+    """Record an email's outcome in the job journal, if there is one"""
+    journal = options.journal if options else None
+    if journal is not None:
+        journal.record(eml_file, extensions, outputs, error)
+
+def batch_render(folder_path, extensions, dark_mode=False, output_dir=None, max_workers=4, recycle_after=100,
+                 options=None):
+    """Render all .eml files under a folder to the given formats through a shared browser pool.
+
+    Emails are submitted as discovery finds them, with at most two per worker
+    waiting, so rendering starts at once and memory does not grow with the
+    size of the tree.
+    """
+    label = format_label(extensions)
+    
+    try:
+        import playwright.sync_api
+    except ImportError:
+        install_playwright()
+        return []
+    
+    print(f"Converting emails under {folder_path} to {label} (using {max_workers} workers)")
+    converted_files = []
+    
+    from concurrent.futures import FIRST_COMPLETED, wait
+    import threading
+    import time
+    
+    # Shared counter for progress tracking
+    counter = 0
+    lock = threading.Lock()
+    
+    def render_with_progress(page, eml_file):
+        nonlocal counter
+        with lock:
+            counter += 1
+            current = counter
+            print(f"Processing {current}: {os.path.basename(eml_file)}")
+        
+        email_output_dir = mirrored_output_dir(eml_file, folder_path, output_dir)
+        try:
+            output_files = render_eml(page, eml_file, extensions, dark_mode, email_output_dir, options)
+        except Exception as e:
+            record_in_journal(options, eml_file, extensions, error=str(e))
+            raise
+        record_in_journal(options, eml_file, extensions, output_files)
+        return output_files
+    
+    def collect(eml_file, future):
+        try:
+            converted_files.extend(future.result())
+        except Exception as e:
+            print(f"Error processing {os.path.basename(eml_file)}: {e}")
+    
+    count = 0
+    deduplicator = Deduplicator() if options is not None and options.dedup else None
+    started = time.perf_counter()
+    with BrowserPool(max_workers, recycle_after, options) as pool:
+        # Bounded window of queued jobs. Whichever finishes first frees a slot,
+        # so one slow email does not hold up submission while other workers idle
+        in_flight = {}
+        for eml_file in discover_emails(folder_path, extensions, options, deduplicator, output_dir):
+            count += 1
+            in_flight[pool.submit(render_with_progress, eml_file)] = eml_file
+            if len(in_flight) >= max_workers * 2:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(in_flight.pop(future), future)
+        for future in wait(in_flight).done:
+            collect(in_flight.pop(future), future)
+    elapsed = time.perf_counter() - started
+    
+    converted_files += finish_deduplication(deduplicator, extensions, folder_path, output_dir, options)
+    if not count:
+        print(f"No .eml files to convert in {folder_path}")
+        return []
+    print(f"Successfully converted {len(converted_files)} files to {label}")
+    print(f"Rendered {count} emails in {elapsed:.1f}s "
+          f"({elapsed / count:.2f}s per email, {pool.launches} browser launches)")
+    return converted_files
+
+def batch_convert_to_pdf(folder_path, dark_mode=False, output_dir=None, max_workers=4, recycle_after=100,
+                         engine="threads", concurrency=64, browsers=1, options=None, processes=None):
+    """Convert all .eml files in a folder to PDF with the threads, async or processes engine"""
+    if engine == "async":
+        return batch_render_async(folder_path, ['.pdf'], dark_mode, output_dir, concurrency, browsers, options)
+    if engine == "processes":
+        return batch_render_processes(folder_path, ['.pdf'], dark_mode, output_dir, processes, recycle_after, options)
+    return batch_render(folder_path, ['.pdf'], dark_mode, output_dir, max_workers, recycle_after, options)
+
+def batch_convert_to_png(folder_path, dark_mode=False, output_dir=None, max_workers=4, recycle_after=100,
+                         engine="threads", concurrency=64, browsers=1, options=None, processes=None):
+    """Convert all .eml files in a folder to PNG with the threads, async or processes engine"""
+    if engine == "async":
+        return batch_render_async(folder_path, ['.png'], dark_mode, output_dir, concurrency, browsers, options)
+    if engine == "processes":
+        return batch_render_processes(folder_path, ['.png'], dark_mode, output_dir, processes, recycle_after, options)
+    return batch_render(folder_path, ['.png'], dark_mode, output_dir, max_workers, recycle_after, options)
+
+def batch_convert_all(folder_path, formats=('html', 'pdf', 'png'), dark_mode=False, output_dir=None, max_workers=4,
+                      recycle_after=100, engine="threads", concurrency=64, browsers=1, options=None, processes=None):
+    """Convert all .eml files in a folder to several formats, parsing and loading each email only once"""
+    extensions = [f'.{fmt}' for fmt in ('html', 'pdf', 'png') if fmt in formats]
+    if not extensions:
+        print("No valid formats requested. Use any of html, pdf, png")
+        return []
+    if extensions == ['.html']:
+        # No browser needed
+        return batch_convert_to_html(folder_path, dark_mode, output_dir, options)
+    if engine == "async":
+        return batch_render_async(folder_path, extensions, dark_mode, output_dir, concurrency, browsers, options)
+    if engine == "processes":
+        return batch_render_processes(folder_path, extensions, dark_mode, output_dir, processes, recycle_after, options)
+    return batch_render(folder_path, extensions, dark_mode, output_dir, max_workers, recycle_after, options)
+
+def convert_to_html(eml_file, dark_mode=False, output_dir=None):
+    """Convert .eml to HTML file; plain-text emails get the same <pre> page as in the other formats"""
+    html_content = extract_email_content(eml_file).source_html
+    
+    if html_content:
+        output_filename = write_html_output(eml_file, html_content, output_dir)
+        print(f"Converted {eml_file} to {output_filename}")
+        return output_filename
+    else:
+        print(f"No HTML content found in {eml_file}")
+        return None
+
+# Dark theme applied to every page in dark mode. It is registered through an
+# init script before the email is parsed, so the document is laid out once,
+# already dark, instead of being restyled after load.
+DARK_MODE_STYLESHEET = """
+    html, body {
+        background-color: #1a1a1a !important;
+        color: #ffffff !important;
+        filter: invert(1) hue-rotate(180deg) !important;
+    }
+
+    /* Force all text to be white */
+    *, p, span, div, td, th, h1, h2, h3, h4, h5, h6 {
+        color: #ffffff !important;
+        background-color: transparent !important;
+    }
+
+    /* Keep images normal - don't invert them */
+    img, video, picture, svg, canvas {
+        filter: none !important;
+    }
+
+    /* Force browsers to print background colors */
+    * {
+        -webkit-print-color-adjust: exact !important;
+        color-adjust: exact !important;
+        print-color-adjust: exact !important;
+    }
+
+    /* Remove white borders around screenshots */
+    @media screen {
+        html, body {
+            margin: 0 !important;
+            padding: 0 !important;
+        }
+    }
+"""
+
+# Adopts DARK_MODE_STYLESHEET as a constructed stylesheet, parsed once per page
+DARK_MODE_INIT_SCRIPT = f"""
+    (() => {{
+        const sheet = new CSSStyleSheet();
+        sheet.replaceSync({json.dumps(DARK_MODE_STYLESHEET)});
+        document.adoptedStyleSheets = [...document.adoptedStyleSheets, sheet];
+    }})();
+"""
+
+def install_playwright():
+    """Install Playwright and its Chromium build after a failed import"""
+    print("Playwright not installed. Installing...")
+    os.system("pip install playwright")
+    os.system("playwright install chromium")
+    print("Please run the script again.")
+
+def get_output_path(eml_file, extension, output_dir=None):
+    """Build the output filename for an .eml file, creating output_dir if needed"""
+    # splitext, not replace('.eml', ...), so 'MAIL.EML' never maps onto itself
+    output_filename = os.path.splitext(os.path.basename(eml_file))[0] + extension
+
+    # Use output directory if specified
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        output_filename = os.path.join(output_dir, output_filename)
+    return output_filename
+
+class atomic_output:
+    """Context manager yielding a temporary path that is renamed to `path` on success.
+
+    The temp file sits next to `path` and keeps its extension, which Playwright
+    uses to pick the screenshot format. An interrupted or failed write never
+    leaves a truncated file under the final name.
+    """
+
+    def __init__(self, path):
+        import uuid
+
+        directory, filename = os.path.split(path)
+        self.path = path
+        self.temp_path = os.path.join(directory, f'.tmp-{uuid.uuid4().hex[:12]}-{filename}')
+
+    def __enter__(self):
+        return self.temp_path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            os.replace(self.temp_path, self.path)
+        elif os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)
+
+# Emails are served to the page from memory under this origin via request
+# interception. The .invalid TLD is reserved, so it can never hit the network.
+EMAIL_ORIGIN = 'http://email.invalid'
+EMAIL_URL = f'{EMAIL_ORIGIN}/email.html'
+
+PDF_OPTIONS = {
+    'format': 'A4',
+    'print_background': True,
+    'prefer_css_page_size': False,
+}
+
+CONTENT_SIZE_SCRIPT = """
+    ({
+        width: document.documentElement.scrollWidth,
+        height: document.documentElement.scrollHeight
+    })
+"""
+
+# Resolves once the DOM is parsed, web fonts are loaded and every image has
+# either loaded or failed, or when the deadline passes first. The result names
+# the condition that fired, e.g. "ready" or "deadline:images".
+RENDER_READY_SCRIPT = """
+    async (deadline) => {
+        let stage = 'dom';
+        const ready = (async () => {
+            if (document.readyState === 'loading') {
+                await new Promise(resolve => document.addEventListener('DOMContentLoaded', resolve, { once: true }));
+            }
+            stage = 'fonts';
+            await document.fonts.ready;
+            stage = 'images';
+            // Include images inside shadow roots, used by thread documents
+            const images = [...document.images];
+            document.querySelectorAll('*').forEach(element => {
+                if (element.shadowRoot) images.push(...element.shadowRoot.querySelectorAll('img'));
+            });
+            await Promise.all(images.map(img => {
+                img.loading = 'eager';
+                if (img.complete) return null;
+                return new Promise(resolve => {
+                    img.addEventListener('load', resolve, { once: true });
+                    img.addEventListener('error', resolve, { once: true });
+                });
+            }));
+            return 'ready';
+        })();
+        const timeout = new Promise(resolve => setTimeout(() => resolve('deadline:' + stage), deadline));
+        return Promise.race([ready, timeout]);
+    }
+"""
+
+# Hosts (matched with their subdomains) and URL fragments of tracking pixels
+# and analytics that are stubbed out instead of fetched
+DEFAULT_BLOCKLIST = [
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'facebook.com/tr',
+    'mixpanel.com',
+    'hubspot.com/e1t',
+    'list-manage.com/track',
+    'mandrillapp.com/track',
+    'sendgrid.net/wf/open',
+    'mailchimp.com/track',
+    'pixel.',
+    '/open.gif',
+    '/track/open',
+    '/beacon',
+]
+
+# 1x1 transparent GIF served in place of blocked images
+BLANK_GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00'
+             b'\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+def load_blocklist(path):
+    """Read blocklist patterns from a file, one per line, ignoring # comments"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+class AssetCache:
+    """Content-addressed on-disk cache of remote email assets.
+
+    Bodies are stored once under objects/ by their SHA-256. Each URL maps to
+    a small JSON entry under urls/ naming the body and its content type. All
+    writes go through a temp file and os.replace(), so any number of worker
+    threads, processes and runs can share one cache directory safely.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'urls'), exist_ok=True)
+
+    def _path(self, kind, digest):
+        return os.path.join(self.directory, kind, digest[:2], digest)
+
+    def _write_atomic(self, path, data):
+        import tempfile
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+    def get(self, url):
+        """Return (content_type, body) for a cached URL, or None"""
+        import hashlib
+
+        entry_path = self._path('urls', hashlib.sha256(url.encode('utf-8')).hexdigest())
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            with open(self._path('objects', entry['sha256']), 'rb') as f:
+                return entry['content_type'], f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, url, content_type, body):
+        import hashlib
+
+        body_digest = hashlib.sha256(body).hexdigest()
+        body_path = self._path('objects', body_digest)
+        if not os.path.exists(body_path):
+            self._write_atomic(body_path, body)
+        entry = {'url': url, 'sha256': body_digest, 'content_type': content_type}
+        entry_path = self._path('urls', hashlib.sha256(url.encode('utf-8')).hexdigest())
+        self._write_atomic(entry_path, json.dumps(entry).encode('utf-8'))
+
+# Milliseconds a remote asset fetch may take before the request is aborted
+ASSET_FETCH_TIMEOUT = 5000
+
+class RemoteAssets:
+    """Request-interception policy for everything an email loads from the web.
+
+    Blocked trackers are stubbed, cached assets are served from the AssetCache,
+    and misses are fetched once and stored, or aborted when offline. A host
+    whose fetch fails or times out is aborted straight away for the rest of
+    the run, so one dead server cannot hold every email to the ready deadline.
+    """
+
+    def __init__(self, cache=None, offline=False, blocklist=None, fetch_timeout=ASSET_FETCH_TIMEOUT):
+        self.cache = cache
+        self.offline = offline
+        self.blocklist = blocklist or []
+        self.fetch_timeout = fetch_timeout
+        # Hosts that failed to answer during this run
+        self.failed_hosts = set()
+
+    def host_failed(self, url):
+        from urllib.parse import urlsplit
+
+        return (urlsplit(url).hostname or '').lower() in self.failed_hosts
+
+    def note_failure(self, url, error):
+        from urllib.parse import urlsplit
+
+        host = (urlsplit(url).hostname or '').lower()
+        if host not in self.failed_hosts:
+            self.failed_hosts.add(host)
+            print(f"Warning: giving up on {host} for this run: {str(error).splitlines()[0]}")
+
+    def is_blocked(self, url):
+        from urllib.parse import urlsplit
+
+        host = (urlsplit(url).hostname or '').lower()
+        for pattern in self.blocklist:
+            if '/' in pattern or pattern.endswith('.'):
+                if pattern in url:
+                    return True
+            elif host == pattern or host.endswith('.' + pattern):
+                return True
+        return False
+
+    def blocked_response(self, resource_type):
+        if resource_type == 'image':
+            return {'status': 200, 'content_type': 'image/gif', 'body': BLANK_GIF}
+        return {'status': 204, 'body': b''}
+
+    def handle(self, route):
+        """Route handler for sync Playwright pages"""
+        request = route.request
+        if not request.url.startswith(('http://', 'https://')):
+            route.continue_()
+            return
+        if self.is_blocked(request.url):
+            route.fulfill(**self.blocked_response(request.resource_type))
+            return
+
+        cacheable = self.cache is not None and request.method == 'GET'
+        if cacheable:
+            cached = self.cache.get(request.url)
+            if cached:
+                route.fulfill(status=200, content_type=cached[0], body=cached[1])
+                return
+        if self.offline:
+            route.abort('internetdisconnected')
+            return
+        if not cacheable:
+            route.continue_()
+            return
+        if self.host_failed(request.url):
+            route.abort('failed')
+            return
+
+        from playwright.sync_api import Error
+
+        try:
+            response = route.fetch(timeout=self.fetch_timeout)
+            body = response.body()
+        except Error as e:
+            # Left unanswered, the page would wait for this request until its deadline
+            self.note_failure(request.url, e)
+            route.abort('failed')
+            return
+        if response.status == 200:
+            self.cache.put(request.url, response.headers.get('content-type', 'application/octet-stream'), body)
+        route.fulfill(response=response, body=body)
+
+    async def async_handle(self, route):
+        """Route handler for async Playwright pages"""
+        import asyncio
+
+        request = route.request
+        if not request.url.startswith(('http://', 'https://')):
+            await route.continue_()
+            return
+        if self.is_blocked(request.url):
+            await route.fulfill(**self.blocked_response(request.resource_type))
+            return
+
+        cacheable = self.cache is not None and request.method == 'GET'
+        if cacheable:
+            cached = await asyncio.to_thread(self.cache.get, request.url)
+            if cached:
+                await route.fulfill(status=200, content_type=cached[0], body=cached[1])
+                return
+        if self.offline:
+            await route.abort('internetdisconnected')
+            return
+        if not cacheable:
+            await route.continue_()
+            return
+        if self.host_failed(request.url):
+            await route.abort('failed')
+            return
+
+        from playwright.async_api import Error
+
+        try:
+            response = await route.fetch(timeout=self.fetch_timeout)
+            body = await response.body()
+        except Error as e:
+            self.note_failure(request.url, e)
+            await route.abort('failed')
+            return
+        if response.status == 200:
+            await asyncio.to_thread(
+                self.cache.put, request.url, response.headers.get('content-type', 'application/octet-stream'), body
+            )
+        await route.fulfill(response=response, body=body)
+
+# Bump when a code change alters rendered output, to invalidate old renders
+RENDER_CACHE_VERSION = 1
+
+class RenderCache:
+    """Content-addressed on-disk cache of rendered PDFs and PNGs.
+
+    Entries are keyed by a SHA-256 over the email's HTML and inline resources,
+    the output format, the dark flag and the render settings, so an unchanged
+    email is never rendered twice. Hits are hard-linked into place, or copied
+    where the cache and the output are on different filesystems. With
+    max_bytes set, evict() drops the least recently used renders until the
+    cache fits.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, 'renders'), exist_ok=True)
+
+    def key(self, content, extension, dark_mode=False, options=None):
+        """Cache key for rendering an EmailContent to extension with these settings"""
+        import hashlib
+
+        options = options or RenderOptions()
+        settings = {
+            'version': RENDER_CACHE_VERSION,
+            'format': extension,
+            'dark': bool(dark_mode),
+            'options': options.fingerprint(),
+        }
+        if extension == '.pdf':
+            settings['pdf'] = PDF_OPTIONS
+        if dark_mode:
+            settings['stylesheet'] = hashlib.sha256(DARK_MODE_STYLESHEET.encode('utf-8')).hexdigest()
+
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        digest.update(content.html.encode('utf-8'))
+        for url in sorted(content.resources):
+            content_type, body = content.resources[url]
+            digest.update(f'\0{url}\0{content_type}\0'.encode('utf-8'))
+            digest.update(hashlib.sha256(body).digest())
+        return digest.hexdigest() + extension
+
+    def _path(self, key):
+        return os.path.join(self.directory, 'renders', key[:2], key)
+
+    def restore(self, key, output_path):
+        """Put the cached render for key at output_path. Returns False on a miss"""
+        path = self._path(key)
+        try:
+            link_atomic(path, output_path)
+            # Mark as recently used for eviction
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def store(self, key, output_path):
+        """Add a freshly rendered file to the cache"""
+        try:
+            link_atomic(output_path, self._path(key))
+        except OSError as e:
+            print(f"Warning: could not add {output_path} to the render cache: {e}")
+
+    def evict(self):
+        """Remove least recently used renders until the cache is within max_bytes.
+
+        Returns (files removed, bytes freed).
+        """
+        if not self.max_bytes:
+            return 0, 0
+        entries = []
+        total = 0
+        for root, _, files in os.walk(os.path.join(self.directory, 'renders')):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        removed = freed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+class JobJournal:
+    """Persistent SQLite record of what a batch has finished.
+
+    Every (email, formats) pair is stored as done, with the files it wrote, or
+    as failed, with the error and the number of failed attempts. A resumed
+    batch skips done emails whose outputs still exist and retries failed ones
+    until max_attempts is reached. Only the process that owns the batch
+    writes, so the connection is opened lazily and never pickled.
+    """
+
+    def __init__(self, path, resume=False, max_attempts=3):
+        import threading
+
+        self.path = path
+        self.resume = resume
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'resume': self.resume, 'max_attempts': self.max_attempts}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        import sqlite3
+
+        if self._connection is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " path TEXT NOT NULL, formats TEXT NOT NULL, state TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0, outputs TEXT, error TEXT, updated REAL,"
+                " PRIMARY KEY (path, formats))"
+            )
+            self._connection = connection
+        return self._connection
+
+    def status(self, eml_file, extensions):
+        """'done', 'exhausted' (failed max_attempts times) or 'pending' for an email"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT state, attempts, outputs FROM jobs WHERE path = ? AND formats = ?",
+                (os.path.abspath(eml_file), format_label(extensions)),
+            ).fetchone()
+        if row is None:
+            return 'pending'
+        state, attempts, outputs = row
+        if state == 'done' and all(os.path.exists(path) for path in json.loads(outputs or '[]')):
+            return 'done'
+        if state == 'failed' and attempts >= self.max_attempts:
+            return 'exhausted'
+        return 'pending'
+
+    def record(self, eml_file, extensions, outputs=None, error=None):
+        """Mark an email done with its outputs, or failed with an error"""
+        import time
+
+        path = os.path.abspath(eml_file)
+        formats = format_label(extensions)
+        with self._lock:
+            if error is None:
+                outputs = json.dumps([os.path.abspath(output) for output in outputs or []])
+                self._connect().execute(
+                    "INSERT INTO jobs (path, formats, state, attempts, outputs, error, updated)"
+                    " VALUES (?, ?, 'done', 0, ?, NULL, ?)"
+                    " ON CONFLICT (path, formats) DO UPDATE SET"
+                    " state = 'done', attempts = 0, outputs = excluded.outputs, error = NULL,"
+                    " updated = excluded.updated",
+                    (path, formats, outputs, time.time()),
+                )
+            else:
+                self._connect().execute(
+                    "INSERT INTO jobs (path, formats, state, attempts, outputs, error, updated)"
+                    " VALUES (?, ?, 'failed', 1, NULL, ?, ?)"
+                    " ON CONFLICT (path, formats) DO UPDATE SET"
+                    " state = 'failed', attempts = jobs.attempts + 1, error = excluded.error,"
+                    " updated = excluded.updated",
+                    (path, formats, str(error), time.time()),
+                )
+
+# Upper bounds in seconds of the stage histograms in the metrics textfile
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Telemetry:
+    """Per-email stage timings and run-level metrics.
+
+    Every timed stage of a conversion (parse, browser launch, goto, waits,
+    dark mode, page.pdf, page.screenshot, writes...) is written as one JSON
+    line to the spans file. The same timings feed stage histograms. Those
+    go to a Prometheus textfile with the emails in flight, browser launches,
+    and failures by exception type. The textfile is rewritten every
+    METRICS_INTERVAL seconds and when the run ends. Worker processes use a
+    forwarder() that only collects spans. The parent absorbs those spans and
+    owns both files.
+    """
+
+    METRICS_INTERVAL = 10
+
+    def __init__(self, spans_path=None, metrics_path=None):
+        import threading
+
+        self.spans_path = spans_path
+        self.metrics_path = metrics_path
+        self.forward = False
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._spans_file = None
+        self._pending = []
+        # stage -> [cumulative bucket counts, sum, count]
+        self._stages = {}
+        self._outcomes = {'converted': 0, 'failed': 0}
+        self._failures = {}
+        self._launches = 0
+        self._metrics_written = 0
+
+    def __getstate__(self):
+        return {'spans_path': self.spans_path, 'metrics_path': self.metrics_path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def forwarder(self):
+        """A Telemetry for a worker process that only collects spans, to be drained"""
+        telemetry = Telemetry()
+        telemetry.forward = True
+        return telemetry
+
+    def span(self, eml_file, stage):
+        """Context manager timing one stage; the 'email' stage spans a whole conversion"""
+        return TelemetrySpan(self, eml_file, stage)
+
+    def enter_email(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave_email(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def set_in_flight(self, count):
+        """For engines whose emails are in flight in other processes"""
+        with self._lock:
+            self.in_flight = count
+            self.max_in_flight = max(self.max_in_flight, count)
+
+    def record(self, span):
+        """Log a finished span and add it to the metrics"""
+        import time
+
+        with self._lock:
+            if self.forward:
+                self._pending.append(span)
+                return
+
+            buckets, total, count = self._stages.setdefault(span['stage'], [[0] * len(STAGE_BUCKETS), 0.0, 0])
+            for index, bound in enumerate(STAGE_BUCKETS):
+                if span['seconds'] <= bound:
+                    buckets[index] += 1
+            self._stages[span['stage']][1:] = [total + span['seconds'], count + 1]
+            if span['stage'] == 'browser_launch' and 'cause' not in span:
+                self._launches += 1
+            if span['stage'] == 'email':
+                self._outcomes['failed' if 'cause' in span else 'converted'] += 1
+                if 'cause' in span:
+                    self._failures[span['cause']] = self._failures.get(span['cause'], 0) + 1
+
+            if self.spans_path:
+                if self._spans_file is None:
+                    os.makedirs(os.path.dirname(self.spans_path) or '.', exist_ok=True)
+                    self._spans_file = open(self.spans_path, 'a', encoding='utf-8', buffering=1)
+                self._spans_file.write(json.dumps(span) + '\n')
+            if self.metrics_path and time.monotonic() - self._metrics_written >= self.METRICS_INTERVAL:
+                self._write_metrics()
+
+    def drain(self):
+        """Spans collected by a forwarding copy since the last drain"""
+        with self._lock:
+            spans, self._pending = self._pending, []
+        return spans
+
+    def absorb(self, spans):
+        """Record spans forwarded from a worker process"""
+        for span in spans:
+            self.record(span)
+
+    def close(self):
+        """Write the final metrics and close the spans file"""
+        with self._lock:
+            if self.metrics_path:
+                self._write_metrics()
+            if self._spans_file is not None:
+                self._spans_file.close()
+                self._spans_file = None
+
+    def _write_metrics(self):
+        import time
+
+        lines = [
+            "# HELP eml_render_stage_seconds Time spent in each stage of converting an email.",
+            "# TYPE eml_render_stage_seconds histogram",
+        ]
+        for stage, (buckets, total, count) in sorted(self._stages.items()):
+            for bound, bucket in zip(STAGE_BUCKETS, buckets):
+                lines.append(f'eml_render_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket}')
+            lines.append(f'eml_render_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'eml_render_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'eml_render_stage_seconds_count{{stage="{stage}"}} {count}')
+        lines += ["# HELP eml_render_emails_total Emails processed, by outcome.",
+                  "# TYPE eml_render_emails_total counter"]
+        lines += [f'eml_render_emails_total{{outcome="{outcome}"}} {count}' for outcome, count in self._outcomes.items()]
+        lines += ["# HELP eml_render_failures_total Failed emails, by exception type.",
+                  "# TYPE eml_render_failures_total counter"]
+        lines += [f'eml_render_failures_total{{cause="{cause}"}} {count}' for cause, count in sorted(self._failures.items())]
+        lines += ["# HELP eml_render_browser_launches_total Browser launches, including relaunches after recycling or crashes.",
+                  "# TYPE eml_render_browser_launches_total counter",
+                  f"eml_render_browser_launches_total {self._launches}",
+                  "# HELP eml_render_in_flight Emails being converted right now.",
+                  "# TYPE eml_render_in_flight gauge",
+                  f"eml_render_in_flight {self.in_flight}",
+                  "# HELP eml_render_in_flight_max Most emails converted at once during the run.",
+                  "# TYPE eml_render_in_flight_max gauge",
+                  f"eml_render_in_flight_max {self.max_in_flight}",
+                  "# HELP eml_render_last_update_timestamp_seconds When these metrics were written.",
+                  "# TYPE eml_render_last_update_timestamp_seconds gauge",
+                  f"eml_render_last_update_timestamp_seconds {time.time():.3f}"]
+
+        # The textfile collector reads *.prom, so the temp name must not end in .prom
+        os.makedirs(os.path.dirname(self.metrics_path) or '.', exist_ok=True)
+        temp_path = f"{self.metrics_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.metrics_path)
+        self._metrics_written = time.monotonic()
+
+class TelemetrySpan:
+    """Times one stage for Telemetry.span(), noting the exception type if it fails"""
+
+    def __init__(self, telemetry, eml_file, stage):
+        self.telemetry = telemetry
+        self.eml_file = eml_file
+        self.stage = stage
+
+    def __enter__(self):
+        import time
+
+        if self.stage == 'email':
+            self.telemetry.enter_email()
+        self.start = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        import threading
+        import time
+
+        span = {
+            'ts': round(self.start, 6),
+            'email': str(self.eml_file) if self.eml_file is not None else None,
+            'stage': self.stage,
+            'seconds': round(time.perf_counter() - self.started, 6),
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+        }
+        if exc_type is not None:
+            span['cause'] = exc_type.__name__
+            span['error'] = str(exc_value)
+        if self.stage == 'email':
+            self.telemetry.leave_email()
+        self.telemetry.record(span)
+
+class NoSpan:
+    """Stand-in for TelemetrySpan when telemetry is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+def stage_span(options, eml_file, stage):
+    """Time a stage of an email's conversion if the run has telemetry"""
+    telemetry = options.telemetry if options is not None else None
+    if telemetry is None:
+        return NoSpan()
+    return telemetry.span(eml_file, stage)
+
+class profiled:
+    """Run a block under cProfile when --profile is set, dumping stats to <profile>.<label>.
+
+    cProfile only sees the thread that enabled it, so the main thread and
+    every browser pool thread each write their own part. collect_profiles()
+    merges them when the run ends.
+    """
+
+    def __init__(self, options, label):
+        profile = options.profile if options is not None else None
+        self.path = f"{profile}.part-{label}" if profile else None
+        self.profiler = None
+
+    def __enter__(self):
+        if self.path:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.profiler.dump_stats(self.path)
+
+def collect_profiles(options, top=25):
+    """Merge the per-thread profile parts into --profile and print the top functions"""
+    import pstats
+
+    parts = glob.glob(f"{glob.escape(options.profile)}.part-*")
+    if not parts:
+        return
+    stats = pstats.Stats(*parts)
+    stats.dump_stats(options.profile)
+    for part in parts:
+        os.unlink(part)
+    print(f"Wrote cProfile stats from {len(parts)} threads to {options.profile}")
+    stats.sort_stats('cumulative').print_stats(top)
+
+class RenderOptions:
+    """Rendering settings shared by the single-file, pooled and async paths"""
+
+    def __init__(self, ready_timeout=10000, assets=None, render_cache=None, journal=None, lightweight=False,
+                 slim=False, dedup=False, telemetry=None, profile=None, max_height=None, tiles=False,
+                 image_format='png', image_quality=85):
+        # Hard deadline in milliseconds for the page to report it is ready
+        self.ready_timeout = ready_timeout
+        # RemoteAssets policy for remote requests, or None to let them through
+        self.assets = assets
+        # RenderCache of finished PDFs and PNGs, or None to always render
+        self.render_cache = render_cache
+        # JobJournal recording each email's outcome in batches, or None
+        self.journal = journal
+        # Typeset simple HTML to PDF with reportlab instead of a browser
+        self.lightweight = lightweight
+        # Sanitise and slim the HTML with slim_email_content() before rendering
+        self.slim = slim
+        # Render repeated copies of a message once in batches (see Deduplicator)
+        self.dedup = dedup
+        # Telemetry receiving stage spans and metrics, or None
+        self.telemetry = telemetry
+        # Path prefix for cProfile dumps, or None
+        self.profile = profile
+        # Screenshot pages taller than this many pixels in bands, or None for one piece
+        self.max_height = max_height
+        # Write the bands of tall pages as numbered images rather than one PNG
+        self.tiles = tiles
+        # 'png', 'jpeg' or 'webp', and the quality of the lossy ones
+        self.image_format = image_format
+        self.image_quality = image_quality
+
+    def fingerprint(self):
+        """The settings that can change rendered output, for render cache keys"""
+        return {
+            'ready_timeout': self.ready_timeout,
+            'lightweight': self.lightweight,
+            'slim': self.slim,
+            'max_height': self.max_height,
+            'offline': self.assets.offline if self.assets else None,
+            'blocklist': sorted(self.assets.blocklist) if self.assets else None,
+        }
+
+def describe_readiness(condition, seconds):
+    """Human-readable summary of what ended the readiness wait"""
+    if condition == 'ready':
+        return f"ready in {seconds:.2f}s"
+    return f"{condition} after {seconds:.2f}s"
+
+def load_email_into_page(page, content, dark_mode=False, options=None, eml_file=None):
+    """Load an EmailContent into a Playwright page and apply dark mode.
+
+    Returns a short description of the readiness condition that fired.
+    """
+    import time
+
+    options = options or RenderOptions()
+
+    # Remote assets go through the cache/blocklist policy. Routes registered
+    # later take precedence, so this catch-all has to come first.
+    if options.assets is not None:
+        page.route("**/*", options.assets.handle)
+
+    # Serve the document and its inline images straight from memory:
+    # no temp files, no local HTTP server
+    def serve_email(route):
+        route.fulfill(**content.response_for(route.request.url))
+
+    page.route(f"{EMAIL_ORIGIN}/**", serve_email)
+    for url in content.external_urls():
+        page.route(url, serve_email)
+
+    # Dark mode is a page feature: emulate the dark color scheme and register
+    # the dark stylesheet before the document is parsed
+    if dark_mode:
+        with stage_span(options, eml_file, 'dark_mode'):
+            page.emulate_media(color_scheme='dark')
+            page.add_init_script(DARK_MODE_INIT_SCRIPT)
+
+    started = time.perf_counter()
+    with stage_span(options, eml_file, 'goto'):
+        page.goto(EMAIL_URL, wait_until='commit')
+    with stage_span(options, eml_file, 'ready_wait'):
+        condition = page.evaluate(RENDER_READY_SCRIPT, options.ready_timeout)
+    return describe_readiness(condition, time.perf_counter() - started)
+
+def save_page_as_pdf(page, eml_file, output_dir=None):
+    """Print a loaded page to PDF with Edge-like settings"""
+    pdf_filename = get_output_path(eml_file, '.pdf', output_dir)
+    with atomic_output(pdf_filename) as temp_path:
+        page.pdf(path=temp_path, **PDF_OPTIONS)
+    return pdf_filename
+
+# File extensions of the screenshot formats offered by --image-format
+IMAGE_EXTENSIONS = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp'}
+# Tallest image each format can encode; taller pages are always tiled
+IMAGE_MAX_HEIGHTS = {'png': None, 'jpeg': 65500, 'webp': 16383}
+
+def image_extension(options=None):
+    """Extension of the screenshot files, .png unless --image-format says otherwise"""
+    return IMAGE_EXTENSIONS[options.image_format if options is not None else 'png']
+
+def capture_band_height(options=None):
+    """Height of the bands tall pages are captured in: --max-height, capped by the format's limit"""
+    if options is None:
+        return None
+    limits = [height for height in (options.max_height, IMAGE_MAX_HEIGHTS[options.image_format]) if height]
+    return min(limits) if limits else None
+
+def save_image(image, path, options=None):
+    """Save a Pillow image as the configured screenshot format"""
+    image_format = options.image_format if options is not None else 'png'
+    if image_format == 'png':
+        image.save(path, 'PNG')
+    else:
+        image.convert('RGB').save(path, image_format.upper(), quality=options.image_quality)
+
+class PngStreamWriter:
+    """Writes an RGB PNG band by band, so the whole image never has to be in memory.
+
+    Rows are stored unfiltered and compressed by one zlib stream that spans
+    all the bands, so the result is a single ordinary PNG. It is somewhat
+    larger than one Chromium encodes with adaptive filters.
+    """
+
+    def __init__(self, file, width, height, level=6):
+        import struct
+        import zlib
+
+        self.file = file
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._compressor = zlib.compressobj(level)
+        file.write(b'\x89PNG\r\n\x1a\n')
+        # 8-bit RGB, no interlacing
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        import struct
+        import zlib
+
+        self.file.write(struct.pack('>I', len(data)) + kind + data
+                        + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write_rows(self, data):
+        """Append whole rows of packed RGB bytes"""
+        stride = self.width * 3
+        rows = min(len(data) // stride, self.height - self.rows)
+        # Each row starts with its filter type, 0 for none
+        raw = b''.join(b'\x00' + data[row * stride:(row + 1) * stride] for row in range(rows))
+        compressed = self._compressor.compress(raw)
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+        self.rows += rows
+
+    def close(self):
+        """Pad any missing rows with white and finish the file"""
+        if self.rows < self.height:
+            white = b'\xff' * (self.width * 3)
+            while self.rows < self.height:
+                self.write_rows(white * min(1024, self.height - self.rows))
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+class TiledImageWriter:
+    """Assembles the bands of a tiled screenshot into its output images.
+
+    Each band arrives as PNG bytes of at most --max-height rows. In the
+    default mode the bands are decoded one at a time and streamed into a
+    single PNG through PngStreamWriter. With --tiles, or with JPEG or WebP
+    output (which cannot be written incrementally), each band is saved as
+    a numbered image: email-001.jpg, email-002.jpg, and so on. Either way
+    at most one band is held in memory. Every image is written under a
+    temporary name and only renamed into place once the whole page is
+    captured, so a failed capture leaves no tiles behind. `files` lists the
+    images written.
+    """
+
+    def __init__(self, eml_file, width, height, options, output_dir=None):
+        self.eml_file = eml_file
+        self.width = width
+        self.height = height
+        self.options = options
+        self.output_dir = output_dir
+        self.files = []
+        self.numbered = options.tiles or options.image_format != 'png'
+        # atomic_output of each numbered tile, renamed into place on success
+        self._tiles = []
+        self._output = None
+        self._file = None
+        self._png = None
+
+    def __enter__(self):
+        if not self.numbered:
+            self._output = atomic_output(get_output_path(self.eml_file, '.png', self.output_dir))
+            self._file = open(self._output.__enter__(), 'wb')
+            self._png = PngStreamWriter(self._file, self.width, self.height)
+        return self
+
+    def add(self, png_bytes):
+        """Take the next band down the page"""
+        import io
+        from PIL import Image
+
+        band = Image.open(io.BytesIO(png_bytes)).convert('RGB')
+        if self.numbered:
+            path = get_output_path(self.eml_file, f'-{len(self._tiles) + 1:03d}{image_extension(self.options)}',
+                                   self.output_dir)
+            tile = atomic_output(path)
+            self._tiles.append(tile)
+            save_image(band, tile.__enter__(), self.options)
+            return
+        if band.width != self.width:
+            # The page grew or shrank sideways while being captured
+            padded = Image.new('RGB', (self.width, band.height), (255, 255, 255))
+            padded.paste(band, (0, 0))
+            band = padded
+        self._png.write_rows(band.tobytes())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._png is None:
+            for tile in self._tiles:
+                tile.__exit__(exc_type, exc_value, traceback)
+            if exc_type is None:
+                self.files = [tile.path for tile in self._tiles]
+            return
+        try:
+            if exc_type is None:
+                self._png.close()
+        finally:
+            self._file.close()
+            self._output.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self.files.append(self._output.path)
+
+def band_clips(content_size, band_height):
+    """Screenshot clip rectangles covering the page from top to bottom"""
+    width, height = content_size['width'], content_size['height']
+    return [{'x': 0, 'y': y, 'width': width, 'height': min(band_height, height - y)}
+            for y in range(0, height, band_height)]
+
+def save_page_as_png(page, eml_file, dark_mode=False, output_dir=None, options=None):
+    """Take a full-page screenshot of a loaded page.
+
+    Pages taller than --max-height, or than the image format can hold, are
+    captured in bands of that height (see TiledImageWriter) instead of one
+    bitmap of the whole page.
+    Returns the list of images written.
+    """
+    options = options or RenderOptions()
+    band_height = capture_band_height(options)
+    content_size = page.evaluate(CONTENT_SIZE_SCRIPT) if dark_mode or band_height else None
+
+    if content_size and band_height and content_size['height'] > band_height:
+        if dark_mode:
+            # Match the content width (no white borders), but only one band tall
+            page.set_viewport_size({'width': content_size['width'], 'height': band_height})
+        with TiledImageWriter(eml_file, content_size['width'], content_size['height'], options,
+                              output_dir) as writer:
+            for clip in band_clips(content_size, band_height):
+                # Bands below the first lie outside the viewport, which a clip
+                # can only reach with full_page set
+                writer.add(page.screenshot(clip=clip, full_page=True))
+        return writer.files
+
+    if dark_mode:
+        # Set viewport to match content size (remove white borders)
+        page.set_viewport_size({
+            'width': content_size['width'],
+            'height': content_size['height']
+        })
+
+    image_filename = get_output_path(eml_file, image_extension(options), output_dir)
+    with atomic_output(image_filename) as temp_path:
+        if options.image_format == 'webp':
+            # Chromium only encodes PNG and JPEG
+            import io
+            from PIL import Image
+
+            save_image(Image.open(io.BytesIO(page.screenshot(full_page=True))), temp_path, options)
+        elif options.image_format == 'jpeg':
+            page.screenshot(path=temp_path, full_page=True, type='jpeg', quality=options.image_quality)
+        else:
+            page.screenshot(path=temp_path, full_page=True)
+    return [image_filename]
+
+async def async_save_page_as_png(page, eml_file, dark_mode=False, output_dir=None, options=None):
+    """Async counterpart of save_page_as_png"""
+    options = options or RenderOptions()
+    band_height = capture_band_height(options)
+    content_size = await page.evaluate(CONTENT_SIZE_SCRIPT) if dark_mode or band_height else None
+
+    if content_size and band_height and content_size['height'] > band_height:
+        if dark_mode:
+            await page.set_viewport_size({'width': content_size['width'], 'height': band_height})
+        with TiledImageWriter(eml_file, content_size['width'], content_size['height'], options,
+                              output_dir) as writer:
+            for clip in band_clips(content_size, band_height):
+                # Bands below the first lie outside the viewport, see save_page_as_png
+                writer.add(await page.screenshot(clip=clip, full_page=True))
+        return writer.files
+
+    if dark_mode:
+        await page.set_viewport_size({
+            'width': content_size['width'],
+            'height': content_size['height']
+        })
+
+    image_filename = get_output_path(eml_file, image_extension(options), output_dir)
+    with atomic_output(image_filename) as temp_path:
+        if options.image_format == 'webp':
+            import io
+            from PIL import Image
+
+            save_image(Image.open(io.BytesIO(await page.screenshot(full_page=True))), temp_path, options)
+        elif options.image_format == 'jpeg':
+            await page.screenshot(path=temp_path, full_page=True, type='jpeg', quality=options.image_quality)
+        else:
+            await page.screenshot(path=temp_path, full_page=True)
+    return [image_filename]
+
+def write_html_output(eml_file, html_content, output_dir=None):
+    """Write extracted email HTML next to the other outputs"""
+    html_filename = get_output_path(eml_file, '.html', output_dir)
+    with atomic_output(html_filename) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+    return html_filename
+
+# Tags reportlab can stand in for. Anything else (tables, images, forms,
+# embedded media) is laid out by the browser.
+SIMPLE_HTML_TAGS = {
+    'html', 'head', 'body', 'meta', 'title', 'p', 'br', 'div', 'span', 'a', 'b', 'strong', 'i', 'em', 'u',
+    'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'code', 'hr', 'font', 'center',
+    'small', 'big', 'sup', 'sub', 'o:p',
+}
+HTML_TAG_PATTERN = re.compile(r'<\s*([a-zA-Z][\w:-]*)')
+# Stylesheets, any inline style (typesetting would drop it) and attributes that paint boxes
+CSS_LAYOUT_PATTERN = re.compile(r'(?i)<style|\sbackground\s*=|\sbgcolor\s*=|\sstyle\s*=')
+# Longer documents are rarely simple, and not worth scanning
+SIMPLE_HTML_MAX_LENGTH = 200 * 1024
+
+def is_simple_html(html):
+    """True for HTML with nothing reportlab cannot lay out: no tables, images or CSS layout"""
+    if len(html) > SIMPLE_HTML_MAX_LENGTH or CSS_LAYOUT_PATTERN.search(html):
+        return False
+    return all(tag.lower() in SIMPLE_HTML_TAGS for tag in set(HTML_TAG_PATTERN.findall(html)))
+
+def typeset_source(content, options=None):
+    """The text to typeset without a browser, or None if the email needs Chromium.
+
+    text/plain emails always qualify. Simple HTML qualifies with the
+    lightweight option and is converted to text with html2text, keeping link
+    text but not the markdown for links and emphasis. Text the
+    built-in PDF fonts cannot encode is left to the browser.
+    """
+    if content.text is not None:
+        text = content.text
+    elif options is not None and options.lightweight and not content.resources and is_simple_html(content.html):
+        import html2text
+
+        converter = html2text.HTML2Text()
+        converter.body_width = 0
+        converter.ignore_emphasis = True
+        converter.ignore_images = True
+        converter.ignore_links = True
+        text = converter.handle(content.html)
+    else:
+        return None
+    try:
+        text.encode('cp1252')
+    except UnicodeEncodeError:
+        return None
+    return text
+
+def save_text_as_pdf(text, eml_file, dark_mode=False, output_dir=None):
+    """Typeset plain text to an A4 PDF with reportlab, without a browser"""
+    from xml.sax.saxutils import escape
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    foreground = colors.white if dark_mode else colors.black
+    body = ParagraphStyle('body', fontName='Helvetica', fontSize=10, leading=14, spaceAfter=6,
+                          textColor=foreground)
+    heading = ParagraphStyle('heading', parent=body, fontName='Helvetica-Bold', fontSize=13, leading=17,
+                             spaceBefore=6)
+
+    story = []
+    for block in re.split(r'\n[ \t]*\n', text.replace('\r\n', '\n').strip()):
+        style = body
+        if re.match(r'#{1,6} ', block):
+            # Markdown heading from html2text
+            block, style = block.lstrip('#').strip(), heading
+        # Keep line breaks and runs of spaces, which plain text mail relies on for layout
+        markup = escape(block).replace('\n', '<br/>')
+        markup = re.sub(r' {2,}', lambda match: '&nbsp;' * len(match.group()), markup)
+        story.append(Paragraph(markup, style))
+
+    def paint_background(canvas, document):
+        if dark_mode:
+            canvas.saveState()
+            canvas.setFillColor(colors.HexColor('#1a1a1a'))
+            canvas.rect(0, 0, A4[0], A4[1], stroke=0, fill=1)
+            canvas.restoreState()
+
+    pdf_filename = get_output_path(eml_file, '.pdf', output_dir)
+    with atomic_output(pdf_filename) as temp_path:
+        document = SimpleDocTemplate(temp_path, pagesize=A4, leftMargin=15 * mm, rightMargin=15 * mm,
+                                     topMargin=15 * mm, bottomMargin=15 * mm)
+        document.build(story or [Spacer(1, 1)], onFirstPage=paint_background, onLaterPages=paint_background)
+    return pdf_filename
+
+# Inline images are downscaled to fit this many pixels on their longest side,
+# and only re-encoded when at least this many bytes
+SLIM_MAX_IMAGE_SIZE = 1600
+SLIM_MIN_IMAGE_BYTES = 64 * 1024
+SLIM_WRAPPER_CHILDREN = {
+    'div': {'div', 'table', 'p', 'center', 'ul', 'ol', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'},
+    'span': {'span'},
+}
+HIDDEN_STYLE_PATTERN = re.compile(r'(?i)(?<![-\w])display\s*:\s*none')
+DATA_IMAGE_PATTERN = re.compile(r'(?is)^\s*data:(image/[\w.+-]+);base64,(.*)$')
+
+def css_pixels(value):
+    """The number in a '1', '1px' or '0.5px' length, or None"""
+    match = re.match(r'\s*(\d+(?:\.\d+)?)\s*(?:px)?\s*$', value or '')
+    return float(match.group(1)) if match else None
+
+def is_tracking_pixel(img):
+    """An <img> sized 1x1 or smaller by its attributes or inline style"""
+    style = img.get('style', '')
+    size = {}
+    for dimension in ('width', 'height'):
+        match = re.search(rf'(?i)(?<![-\w]){dimension}\s*:\s*([\d.]+)px', style)
+        size[dimension] = css_pixels(match.group(1)) if match else css_pixels(img.get(dimension))
+    return all(value is not None and value <= 1 for value in size.values())
+
+def downscale_image(content_type, data):
+    """Shrink an oversized image to SLIM_MAX_IMAGE_SIZE, returning (content_type, data).
+
+    The original is kept when it is small, animated, unreadable, or when
+    re-encoding would not make it smaller.
+    """
+    if len(data) < SLIM_MIN_IMAGE_BYTES:
+        return content_type, data
+    try:
+        from io import BytesIO
+        from PIL import Image
+    except ImportError:
+        return content_type, data
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if getattr(image, 'n_frames', 1) > 1 or max(image.size) <= SLIM_MAX_IMAGE_SIZE:
+                return content_type, data
+            image.thumbnail((SLIM_MAX_IMAGE_SIZE, SLIM_MAX_IMAGE_SIZE))
+            output = BytesIO()
+            if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+                image.save(output, 'PNG', optimize=True)
+                slim_type = 'image/png'
+            else:
+                image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True)
+                slim_type = 'image/jpeg'
+    except Exception:
+        return content_type, data
+    if output.tell() >= len(data):
+        return content_type, data
+    return slim_type, output.getvalue()
+
+def slim_email_content(content):
+    """Sanitise and slim an email's HTML before it is rendered.
+
+    Strips scripts, event handlers and javascript: URLs, drops tracking
+    pixels and display:none elements, downscales oversized inline images
+    (data: URLs and cid: parts) and unwraps attribute-less wrappers that
+    hold a single element. Returns (slimmed EmailContent, summary of the
+    bytes saved).
+    """
+    import base64
+    from bs4 import BeautifulSoup
+
+    counts = {'scripts': 0, 'handlers': 0, 'hidden': 0, 'beacons': 0, 'images': 0, 'wrappers': 0}
+    soup = BeautifulSoup(content.html, 'html.parser')
+
+    for script in soup.find_all('script'):
+        script.decompose()
+        counts['scripts'] += 1
+    for tag in soup.find_all(True):
+        for attribute in list(tag.attrs):
+            value = tag.attrs[attribute]
+            if attribute.lower().startswith('on') or (
+                isinstance(value, str) and value.strip().lower().startswith('javascript:')
+            ):
+                del tag.attrs[attribute]
+                counts['handlers'] += 1
+
+    for tag in soup.find_all(style=HIDDEN_STYLE_PATTERN):
+        if not tag.decomposed:
+            tag.decompose()
+            counts['hidden'] += 1
+
+    for img in soup.find_all('img'):
+        if img.decomposed:
+            continue
+        if is_tracking_pixel(img):
+            img.decompose()
+            counts['beacons'] += 1
+            continue
+        match = DATA_IMAGE_PATTERN.match(img.get('src', ''))
+        if match:
+            try:
+                data = base64.b64decode(match.group(2), validate=False)
+            except ValueError:
+                continue
+            slim_type, slim_data = downscale_image(match.group(1), data)
+            if slim_data is not data:
+                img['src'] = f'data:{slim_type};base64,{base64.b64encode(slim_data).decode("ascii")}'
+                counts['images'] += 1
+
+    # Innermost first, so nested wrappers collapse one level at a time
+    for tag in reversed(soup.find_all(list(SLIM_WRAPPER_CHILDREN))):
+        if tag.attrs or tag.parent is None:
+            continue
+        children = [child for child in tag.contents if getattr(child, 'name', None) or str(child).strip()]
+        if len(children) == 1 and getattr(children[0], 'name', None) in SLIM_WRAPPER_CHILDREN[tag.name]:
+            tag.unwrap()
+            counts['wrappers'] += 1
+
+    resources = {}
+    for url, (content_type, body) in content.resources.items():
+        if content_type.startswith('image/'):
+            slim_type, slim_body = downscale_image(content_type, body)
+            if slim_body is not body:
+                counts['images'] += 1
+            resources[url] = (slim_type, slim_body)
+        else:
+            resources[url] = (content_type, body)
+
+    html = str(soup)
+    before = len(content.html.encode('utf-8')) + sum(len(body) for _, body in content.resources.values())
+    after = len(html.encode('utf-8')) + sum(len(body) for _, body in resources.values())
+    removed = ', '.join(f"{count} {name}" for name, count in counts.items() if count)
+    if not removed and after >= before:
+        # Nothing was taken out; keep the original markup rather than bs4's re-serialisation
+        return content, "nothing to slim"
+    summary = f"slimmed {before - after:,} of {before:,} bytes" + (f": {removed}" if removed else "")
+    return EmailContent(html, resources, content.source_html, content.text), summary
+
+def restore_cached_renders(content, eml_file, extensions, dark_mode=False, output_dir=None, options=None):
+    """Restore the PDF and PNG renders of an email from the render cache.
+
+    Returns (files restored, extensions still to render, {extension: cache key}).
+    """
+    renders = [extension for extension in extensions if extension in ('.pdf', '.png')]
+    cache = options.render_cache if options else None
+    if cache is None:
+        return [], renders, {}
+
+    restored, missing, keys = [], [], {}
+    for extension in renders:
+        if extension == '.png' and options is not None and (options.tiles or options.image_format != 'png'):
+            # Numbered or non-PNG images are not one file under the .png name
+            missing.append(extension)
+            continue
+        key = cache.key(content, extension, dark_mode, options)
+        output_path = get_output_path(eml_file, extension, output_dir)
+        if cache.restore(key, output_path):
+            restored.append(output_path)
+        else:
+            # Outputs are replaced by rename, never rewritten in place, so a
+            # stale hard link to the cache is safe to render over
+            missing.append(extension)
+            keys[extension] = key
+    return restored, missing, keys
+
+def store_cached_renders(keys, output_files, options=None):
+    """Add newly rendered outputs to the render cache"""
+    for output_path in output_files:
+        key = keys.get(os.path.splitext(output_path)[1])
+        if key:
+            options.render_cache.store(key, output_path)
+
+def describe_conversion(readiness, restored, slimmed=None):
+    """The parenthesised note after 'Converted ...', e.g. ' (ready in 0.41s)'"""
+    notes = [readiness] if readiness else []
+    if slimmed:
+        notes.append(slimmed)
+    if restored:
+        notes.append(f"{len(restored)} from render cache")
+    return f" ({'; '.join(notes)})" if notes else ""
+
+def render_eml(page, eml_file, extensions, dark_mode=False, output_dir=None, options=None):
+    """Render one .eml file to any of .html, .pdf and .png on an already-open page.
+
+    The email is parsed once and loaded into the page once, however many
+    formats are requested, and not at all when the render cache has every
+    format. Returns the list of files written.
+    """
+    with stage_span(options, eml_file, 'email'):
+        with stage_span(options, eml_file, 'parse'):
+            content = extract_email_content(eml_file)
+        if not content.html:
+            print(f"No HTML content found in {eml_file}")
+            return []
+
+        output_files = []
+        if '.html' in extensions:
+            with stage_span(options, eml_file, 'write_html'):
+                output_files.append(write_html_output(eml_file, content.source_html, output_dir))
+
+        with stage_span(options, eml_file, 'cache_restore'):
+            restored, missing, keys = restore_cached_renders(content, eml_file, extensions, dark_mode, output_dir,
+                                                             options)
+        slimmed = None
+        if missing and options is not None and options.slim:
+            with stage_span(options, eml_file, 'slim'):
+                content, slimmed = slim_email_content(content)
+        readiness = None
+        rendered = []
+        text = typeset_source(content, options) if '.pdf' in missing else None
+        if text is not None:
+            # Plain text and simple HTML are typeset without loading the page
+            with stage_span(options, eml_file, 'typeset'):
+                rendered.append(save_text_as_pdf(text, eml_file, dark_mode, output_dir))
+            missing.remove('.pdf')
+            readiness = "typeset without a browser"
+        if missing:
+            readiness = load_email_into_page(page, content, dark_mode, options, eml_file)
+        # PDF first: the PNG capture may resize the viewport
+        if '.pdf' in missing:
+            with stage_span(options, eml_file, 'pdf'):
+                rendered.append(save_page_as_pdf(page, eml_file, output_dir))
+        if '.png' in missing:
+            with stage_span(options, eml_file, 'screenshot'):
+                rendered += save_page_as_png(page, eml_file, dark_mode, output_dir, options)
+        with stage_span(options, eml_file, 'cache_store'):
+            store_cached_renders(keys, rendered, options)
+        output_files += rendered + restored
+
+    print(f"Converted {eml_file} to {', '.join(output_files)}" + describe_conversion(readiness, restored, slimmed))
+    return output_files
+
+class LazyPage:
+    """Stands in for a Playwright page and only opens one when it is first used.
+
+    Jobs that never touch the page, such as emails typeset without a
+    browser, then cost no browser launch and no context.
+    """
+
+    def __init__(self, open_page):
+        self._open_page = open_page
+        self._page = None
+
+    def __getattr__(self, name):
+        if self._page is None:
+            self._page = self._open_page()
+        return getattr(self._page, name)
+
+class AsyncLazyPage:
+    """Async counterpart of LazyPage: the page is opened when a method is first awaited.
+
+    Every page method the async engine uses is a coroutine, so each
+    attribute is returned as a coroutine function that opens the page first.
+    """
+
+    def __init__(self, open_page):
+        self._open_page = open_page
+        self._page = None
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            if self._page is None:
+                self._page = await self._open_page()
+            return await getattr(self._page, name)(*args, **kwargs)
+        return call
+
+class BrowserPool:
+    """A fixed set of warm Chromium browsers shared by batch conversions.
+
+    Playwright's sync API is bound to the thread that started it, so each
+    browser lives on its own worker thread and pulls render jobs from a shared
+    queue. Every job that uses its page gets a fresh browser context, which
+    keeps emails isolated from each other, and each browser is relaunched
+    after ``recycle_after`` renders to keep Chromium's memory growth in check.
+    Browsers start on first use, so jobs that never touch the page are free.
+    With handle_signals off, Ctrl-C and SIGTERM do not close the browsers,
+    so the caller decides when to stop.
+    """
+
+    def __init__(self, size=4, recycle_after=100, options=None, handle_signals=True):
+        import queue
+        import threading
+
+        self.size = size
+        self.recycle_after = recycle_after
+        self.handle_signals = handle_signals
+        # Telemetry and profiling settings of the run
+        self.options = options
+        self.launches = 0
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(size):
+            thread = threading.Thread(target=self._worker, name=f"browser-pool-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, render, *args):
+        """Queue render(page, *args) and return a Future for its result"""
+        from concurrent.futures import Future
+
+        future = Future()
+        self._jobs.put((future, render, args))
+        return future
+
+    def warm_up(self):
+        """Launch every browser now rather than on first use; returns the launch error, if any"""
+        for future in [self.submit(touch_page) for _ in range(self.size)]:
+            try:
+                future.result()
+            except Exception as e:
+                return e
+        return None
+
+    def close(self):
+        """Finish queued jobs, then shut down every browser"""
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _launch(self, playwright):
+        with stage_span(self.options, None, 'browser_launch'):
+            browser = playwright.chromium.launch(handle_sigint=self.handle_signals,
+                                                 handle_sigterm=self.handle_signals)
+        with self._lock:
+            self.launches += 1
+        return browser
+
+    def _worker(self):
+        import threading
+
+        with profiled(self.options, f"{os.getpid()}-{threading.current_thread().name}"):
+            self._serve()
+
+    def _serve(self):
+        from playwright.sync_api import sync_playwright
+
+        playwright = None
+        browser = None
+        renders = 0
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            future, render, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            context = None
+
+            def open_page():
+                # The driver, the browser and a context are only started when
+                # a job first uses its page
+                nonlocal playwright, browser, renders, context
+                if playwright is None:
+                    playwright = sync_playwright().start()
+                if browser is None:
+                    browser = self._launch(playwright)
+                    renders = 0
+                with stage_span(self.options, None, 'new_page'):
+                    context = browser.new_context()
+                    return context.new_page()
+
+            try:
+                try:
+                    future.set_result(render(LazyPage(open_page), *args))
+                finally:
+                    if context is not None:
+                        context.close()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                # A crashed browser is replaced on the next job
+                if browser is not None and not browser.is_connected():
+                    browser = None
+
+            if context is not None:
+                renders += 1
+            if browser is not None and renders >= self.recycle_after:
+                browser.close()
+                browser = None
+
+        if browser is not None:
+            browser.close()
+        if playwright is not None:
+            playwright.stop()
+
+async def async_load_email_into_page(page, content, dark_mode=False, options=None, eml_file=None):
+    """Async counterpart of load_email_into_page for the asyncio engine"""
+    import time
+
+    options = options or RenderOptions()
+
+    if options.assets is not None:
+        await page.route("**/*", options.assets.async_handle)
+
+    async def serve_email(route):
+        await route.fulfill(**content.response_for(route.request.url))
+
+    await page.route(f"{EMAIL_ORIGIN}/**", serve_email)
+    for url in content.external_urls():
+        await page.route(url, serve_email)
+    if dark_mode:
+        with stage_span(options, eml_file, 'dark_mode'):
+            await page.emulate_media(color_scheme='dark')
+            await page.add_init_script(DARK_MODE_INIT_SCRIPT)
+
+    # Spans of awaited stages include time the event loop spent on other pages
+    started = time.perf_counter()
+    with stage_span(options, eml_file, 'goto'):
+        await page.goto(EMAIL_URL, wait_until='commit')
+    with stage_span(options, eml_file, 'ready_wait'):
+        condition = await page.evaluate(RENDER_READY_SCRIPT, options.ready_timeout)
+    return describe_readiness(condition, time.perf_counter() - started)
+
+async def async_render_eml(page, eml_file, extensions, dark_mode=False, output_dir=None, options=None):
+    """Async counterpart of render_eml, producing the same output names"""
+    import asyncio
+
+    with stage_span(options, eml_file, 'email'):
+        with stage_span(options, eml_file, 'parse'):
+            content = await asyncio.to_thread(extract_email_content, eml_file)
+        if not content.html:
+            print(f"No HTML content found in {eml_file}")
+            return []
+
+        output_files = []
+        if '.html' in extensions:
+            with stage_span(options, eml_file, 'write_html'):
+                output_files.append(await asyncio.to_thread(write_html_output, eml_file, content.source_html,
+                                                            output_dir))
+
+        with stage_span(options, eml_file, 'cache_restore'):
+            restored, missing, keys = await asyncio.to_thread(
+                restore_cached_renders, content, eml_file, extensions, dark_mode, output_dir, options
+            )
+        slimmed = None
+        if missing and options is not None and options.slim:
+            with stage_span(options, eml_file, 'slim'):
+                content, slimmed = await asyncio.to_thread(slim_email_content, content)
+        readiness = None
+        rendered = []
+        text = typeset_source(content, options) if '.pdf' in missing else None
+        if text is not None:
+            with stage_span(options, eml_file, 'typeset'):
+                rendered.append(await asyncio.to_thread(save_text_as_pdf, text, eml_file, dark_mode, output_dir))
+            missing.remove('.pdf')
+            readiness = "typeset without a browser"
+        if missing:
+            readiness = await async_load_email_into_page(page, content, dark_mode, options, eml_file)
+        if '.pdf' in missing:
+            with stage_span(options, eml_file, 'pdf'):
+                pdf_filename = get_output_path(eml_file, '.pdf', output_dir)
+                with atomic_output(pdf_filename) as temp_path:
+                    await page.pdf(path=temp_path, **PDF_OPTIONS)
+            rendered.append(pdf_filename)
+        if '.png' in missing:
+            with stage_span(options, eml_file, 'screenshot'):
+                rendered += await async_save_page_as_png(page, eml_file, dark_mode, output_dir, options)
+        with stage_span(options, eml_file, 'cache_store'):
+            await asyncio.to_thread(store_cached_renders, keys, rendered, options)
+        output_files += rendered + restored
+
+    print(f"Converted {eml_file} to {', '.join(output_files)}" + describe_conversion(readiness, restored, slimmed))
+    return output_files
+
+async def async_batch_render(eml_files, extensions, dark_mode=False, output_dir=None, concurrency=64, browsers=1,
+                             options=None, root=None):
+    """Render many emails from one event loop with at most `concurrency` pages in flight.
+
+    eml_files may be any iterable, including a lazy discovery generator. It is
+    advanced on a worker thread, as are journal writes, so file reads,
+    fingerprinting and SQLite lookups never stall the pages in flight. With
+    root set, outputs mirror each email's place under it. Returns
+    (files written, emails seen).
+    """
+    import asyncio
+    from playwright.async_api import async_playwright
+
+    converted_files = []
+    semaphore = asyncio.Semaphore(concurrency)
+    count = 0
+
+    async with async_playwright() as p:
+        # Browsers are launched when an email first needs a page, so a batch
+        # that is all typeset launches none
+        pool = [None] * browsers
+        launch_lock = asyncio.Lock()
+
+        async def get_browser(index):
+            async with launch_lock:
+                if pool[index] is None:
+                    with stage_span(options, None, 'browser_launch'):
+                        pool[index] = await p.chromium.launch()
+            return pool[index]
+
+        async def render_one(index, eml_file):
+            try:
+                print(f"Processing {index}: {os.path.basename(eml_file)}")
+                email_output_dir = mirrored_output_dir(eml_file, root, output_dir) if root else output_dir
+                context = None
+
+                async def open_page():
+                    nonlocal context
+                    browser = await get_browser(index % browsers)
+                    with stage_span(options, eml_file, 'new_page'):
+                        context = await browser.new_context()
+                        return await context.new_page()
+
+                try:
+                    result = await async_render_eml(AsyncLazyPage(open_page), eml_file, extensions, dark_mode,
+                                                    email_output_dir, options)
+                finally:
+                    if context is not None:
+                        await context.close()
+                converted_files.extend(result)
+                await asyncio.to_thread(record_in_journal, options, eml_file, extensions, result)
+            except Exception as e:
+                print(f"Error processing {os.path.basename(eml_file)}: {e}")
+                await asyncio.to_thread(record_in_journal, options, eml_file, extensions, error=str(e))
+            finally:
+                semaphore.release()
+
+        # Acquire before creating each task so only `concurrency` coroutines exist at once
+        tasks = set()
+        emails = iter(eml_files)
+        while True:
+            # Discovery reads files and the journal; keep it off the event loop
+            eml_file = await asyncio.to_thread(next, emails, None)
+            if eml_file is None:
+                break
+            count += 1
+            await semaphore.acquire()
+            task = asyncio.create_task(render_one(count, eml_file))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+        for browser in pool:
+            if browser is not None:
+                await browser.close()
+
+    return converted_files, count
+
+def batch_render_async(folder_path, extensions, dark_mode=False, output_dir=None, concurrency=64, browsers=1,
+                       options=None):
+    """Render all .eml files under a folder with the asyncio engine"""
+    import asyncio
+    import time
+
+    label = format_label(extensions)
+
+    try:
+        import playwright.async_api
+    except ImportError:
+        install_playwright()
+        return []
+
+    print(f"Converting emails under {folder_path} to {label} "
+          f"(async engine, {concurrency} pages across {browsers} browser(s))")
+
+    deduplicator = Deduplicator() if options is not None and options.dedup else None
+    eml_files = discover_emails(folder_path, extensions, options, deduplicator, output_dir)
+    started = time.perf_counter()
+    try:
+        converted_files, count = asyncio.run(
+            async_batch_render(eml_files, extensions, dark_mode, output_dir, concurrency, browsers, options,
+                               root=folder_path)
+        )
+    except Exception as e:
+        print(f"Error running async batch: {e}")
+        return []
+    elapsed = time.perf_counter() - started
+
+    converted_files += finish_deduplication(deduplicator, extensions, folder_path, output_dir, options)
+    if not count:
+        print(f"No .eml files to convert in {folder_path}")
+        return []
+    print(f"Successfully converted {len(converted_files)} files to {label}")
+    print(f"Rendered {count} emails in {elapsed:.1f}s ({elapsed / count:.2f}s per email)")
+    return converted_files
+
+def process_worker(shards, results, stop, extensions, dark_mode, recycle_after, options):
+    """Worker process for batch_render_processes: owns one browser and pulls shards until told to stop"""
+    import signal
+
+    # Ctrl-C is handled by the parent, which asks workers to stop via `stop`.
+    # A session of its own keeps the terminal's Ctrl-C away from this worker's
+    # Playwright driver and browser too, which would otherwise die mid-email
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(os, 'setsid'):
+        try:
+            os.setsid()
+        except OSError:
+            pass
+
+    # Spans go back to the parent with each result; only the parent writes the files
+    telemetry = None
+    if options is not None and options.telemetry is not None:
+        telemetry = options.telemetry = options.telemetry.forwarder()
+    with BrowserPool(1, recycle_after, options, handle_signals=False) as pool:
+        while not stop.is_set():
+            shard = shards.get()
+            if shard is None:
+                break
+            for eml_file, output_dir in shard:
+                if stop.is_set():
+                    break
+                try:
+                    future = pool.submit(render_eml, eml_file, extensions, dark_mode, output_dir, options)
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, str(e)
+                results.put((eml_file, result, error, telemetry.drain() if telemetry else []))
+
+def batch_render_processes(folder_path, extensions, dark_mode=False, output_dir=None, processes=None,
+                           recycle_after=100, options=None, shard_size=4):
+    """Render all .eml files under a folder across worker processes, each with its own browser.
+
+    A feeder thread walks the input as the workers run and cuts it into small
+    shards on a bounded queue. Idle workers take the next shard, so a worker
+    that finishes early takes over work a slower one has not reached yet. The
+    parent only discovers emails and aggregates results, which keeps
+    progress output, MIME parsing and driver I/O out of a single GIL.
+    """
+    import multiprocessing
+    import queue
+    import threading
+    import time
+
+    label = format_label(extensions)
+
+    try:
+        import playwright.sync_api
+    except ImportError:
+        install_playwright()
+        return []
+
+    processes = processes or os.cpu_count() or 1
+    print(f"Converting emails under {folder_path} to {label} (using {processes} processes)")
+
+    shards = multiprocessing.Queue(maxsize=processes * 2)
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(
+            target=process_worker,
+            args=(shards, results, stop, extensions, dark_mode, recycle_after, options),
+            daemon=True,
+        )
+        for _ in range(processes)
+    ]
+
+    submitted = 0
+    fed_all = threading.Event()
+    deduplicator = Deduplicator() if options is not None and options.dedup else None
+
+    def put(item):
+        # Block while the queue is full, but give up once the batch is stopping
+        while not stop.is_set():
+            try:
+                shards.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def feed():
+        nonlocal submitted
+        try:
+            shard = []
+            for eml_file in discover_emails(folder_path, extensions, options, deduplicator, output_dir):
+                shard.append((eml_file, mirrored_output_dir(eml_file, folder_path, output_dir)))
+                if len(shard) == shard_size:
+                    submitted += len(shard)
+                    if not put(shard):
+                        return
+                    shard = []
+            if shard:
+                submitted += len(shard)
+                put(shard)
+        except Exception as e:
+            print(f"Error reading {folder_path}: {e}")
+        finally:
+            for _ in workers:
+                put(None)
+            fed_all.set()
+
+    converted_files = []
+    done = 0
+
+    def collect(eml_file, result, error, spans):
+        nonlocal done
+        done += 1
+        if options is not None and options.telemetry is not None:
+            options.telemetry.absorb(spans)
+            options.telemetry.set_in_flight(submitted - done)
+        print(f"Processed {done}: {os.path.basename(eml_file)}")
+        if error:
+            print(f"Error processing {os.path.basename(eml_file)}: {error}")
+        else:
+            converted_files.extend(result)
+        record_in_journal(options, eml_file, extensions, result, error)
+
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    feeder = threading.Thread(target=feed, name="shard-feeder", daemon=True)
+    feeder.start()
+    try:
+        while not (fed_all.is_set() and done >= submitted):
+            try:
+                collect(*results.get(timeout=1))
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    print(f"Warning: all worker processes exited with {submitted - done} emails unprocessed")
+                    stop.set()
+                    break
+    except KeyboardInterrupt:
+        print("Interrupted, letting workers finish their current email...")
+        stop.set()
+    finally:
+        # Keep draining results while workers wind down, so none of them
+        # blocks on a full result pipe before it can exit. Emails finished in
+        # the meantime are recorded like any other, so --resume skips them
+        deadline = time.monotonic() + 30
+        while any(worker.is_alive() for worker in workers) and time.monotonic() < deadline:
+            try:
+                collect(*results.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        # Results sent just before a worker exited
+        while True:
+            try:
+                collect(*results.get(timeout=0.1))
+            except queue.Empty:
                 break
-    else:
-        if msg.get_content_type() == 'text/html':
-            html_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-    
-    return html_content
-
-def get_eml_files_from_folder(folder_path):
-    """Get all .eml files from a folder"""
-    if os.path.isfile(folder_path):
-        # If it's a single file, return it
-        return [folder_path] if folder_path.lower().endswith('.eml') else []
-    
-    # If it's a folder, get all .eml files
-    pattern = os.path.join(folder_path, "*.eml")
-    eml_files = glob.glob(pattern)
-    return sorted(eml_files)  # Sort for consistent processing order
+        stop.set()
+        feeder.join()
+    elapsed = time.perf_counter() - started
 
-def batch_convert_to_html(folder_path, dark_mode=False, output_dir=None):
-    """Convert all .eml files in a folder to HTML"""
-    eml_files = get_eml_files_from_folder(folder_path)
-    
-    if not eml_files:
-        print(f"No .eml files found in {folder_path}")
+    converted_files += finish_deduplication(deduplicator, extensions, folder_path, output_dir, options)
+    if not done and not submitted:
+        print(f"No .eml files to convert in {folder_path}")
         return []
-    
-    print(f"Found {len(eml_files)} .eml files to convert to HTML")
-    converted_files = []
-    
-    for i, eml_file in enumerate(eml_files, 1):
-        print(f"Processing {i}/{len(eml_files)}: {os.path.basename(eml_file)}")
-        result = convert_to_html(eml_file, dark_mode, output_dir)
-        if result:
-            converted_files.append(result)
-    
-    print(f"Successfully converted {len(converted_files)} files to HTML")
+    print(f"Successfully converted {len(converted_files)} files to {label}")
+    print(f"Rendered {done} emails in {elapsed:.1f}s "
+          f"({elapsed / max(done, 1):.2f}s per email across {processes} processes)")
     return converted_files
 
-def batch_convert_to_pdf(folder_path, dark_mode=False, output_dir=None, max_workers=4):
-    """Convert all .eml files in a folder to PDF using concurrent processing"""
-    eml_files = get_eml_files_from_folder(folder_path)
-    
-    if not eml_files:
-        print(f"No .eml files found in {folder_path}")
-        return []
-    
-    print(f"Found {len(eml_files)} .eml files to convert to PDF (using {max_workers} workers)")
-    converted_files = []
-    
-    # Start shared HTTP server for dark mode if needed
-    server_thread = None
-    if dark_mode:
-        import http.server
-        import socketserver
+# Seconds an email's size and mtime must stay unchanged before --watch renders it
+WATCH_SETTLE_SECONDS = 2
+# Seconds between checks of the watched folder
+WATCH_POLL_SECONDS = 1
+# Renders between render-cache evictions in --watch and --serve, which never finish a run
+RENDER_CACHE_EVICT_EVERY = 50
+
+class FolderWatcher:
+    """Reports .eml files under a folder that are new or changed, once they have stopped changing.
+
+    With the optional watchdog package, file system notifications flag
+    changed files and the folder is scanned only once, at start. Without
+    it, or with poll=True (for network shares that send no notifications),
+    scan() is repeated and compares each file's size and mtime. Either way
+    a flagged file is only reported by settled() once its size and mtime
+    have not changed for `settle` seconds. That way a file still being
+    copied in is never rendered half-written.
+    """
+
+    def __init__(self, folder_path, settle=WATCH_SETTLE_SECONDS, poll=False):
         import threading
+
+        self.folder_path = folder_path
+        self.settle = settle
+        self.poll = poll
+        self._lock = threading.Lock()
+        # path -> (size, mtime_ns) as of the last scan
+        self._seen = {}
+        # path -> ((size, mtime_ns) or None, time it was last seen changing)
+        self._pending = {}
+        self._observer = None
+
+    @property
+    def observing(self):
+        return self._observer is not None
+
+    def start(self):
+        """Subscribe to file system notifications if watchdog is installed"""
+        if self.poll:
+            return
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog is not installed, polling for changes instead (pip install watchdog)")
+            return
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Opens and reads, including our own while rendering, are not changes
+                if not event.is_directory and event.event_type in ('created', 'modified', 'moved', 'closed'):
+                    # Moves report the new name; files renamed into place count as new
+                    watcher.notice(getattr(event, 'dest_path', '') or event.src_path)
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), self.folder_path, recursive=True)
+        self._observer.start()
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+    def is_watched(self, path):
+        """Plain .eml files, skipping hidden files and folders like the batch walk does"""
+        relative = os.path.relpath(path, self.folder_path)
+        return (path.lower().endswith('.eml')
+                and not any(part.startswith('.') for part in relative.split(os.sep)))
+
+    def notice(self, path):
+        """Flag a file as possibly new or changed"""
+        path = os.fsdecode(path)
+        if self.is_watched(path):
+            with self._lock:
+                self._pending[path] = (None, 0)
+
+    def scan(self):
+        """Stat every .eml under the folder; return those new or changed since the last scan"""
+        current = {}
+        folders = [self.folder_path]
+        while folders:
+            try:
+                entries = list(os.scandir(folders.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir():
+                        folders.append(entry.path)
+                    elif entry.name.lower().endswith('.eml'):
+                        stat = entry.stat()
+                        current[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+        changed = [path for path, signature in current.items() if self._seen.get(path) != signature]
+        self._seen = current
+        return sorted(changed)
+
+    def settled(self):
+        """Flagged files whose size and mtime have held still for `settle` seconds"""
         import time
-        
-        def start_server():
-            PORT = 8000
-            Handler = http.server.SimpleHTTPRequestHandler
-            with socketserver.TCPServer(("", PORT), Handler) as httpd:
-                httpd.serve_forever()
-        
-        server_thread = threading.Thread(target=start_server, daemon=True)
-        server_thread.start()
-        time.sleep(2)
-    
+
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, (signature, since) in list(self._pending.items()):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Deleted or moved away before it settled
+                    del self._pending[path]
+                    continue
+                current = (stat.st_size, stat.st_mtime_ns)
+                if current != signature:
+                    self._pending[path] = (current, now)
+                elif now - since >= self.settle:
+                    del self._pending[path]
+                    ready.append(path)
+        return sorted(ready)
+
+def outputs_up_to_date(eml_file, extensions, output_dir=None, options=None):
+    """Whether every output of an email exists and is newer than the email"""
     try:
-        # Use ThreadPoolExecutor for concurrent processing
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import threading
-        
-        # Shared counter for progress tracking
-        counter = 0
-        lock = threading.Lock()
-        
-        def convert_with_progress(eml_file):
-            nonlocal counter
-            with lock:
-                counter += 1
-                current = counter
-                total = len(eml_files)
-                print(f"Processing {current}/{total}: {os.path.basename(eml_file)}")
-            
-            result = convert_to_pdf(eml_file, dark_mode, output_dir, shared_server=dark_mode)
-            return result
-        
-        # Process files concurrently
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_file = {executor.submit(convert_with_progress, eml_file): eml_file for eml_file in eml_files}
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_file):
-                eml_file = future_to_file[future]
+        modified = os.path.getmtime(eml_file)
+        for extension in extensions:
+            outputs = find_outputs(eml_file, extension, output_dir, options)
+            if not outputs or any(os.path.getmtime(path) < modified for path in outputs):
+                return False
+        return True
+    except OSError:
+        return False
+
+def watch_folder(folder_path, extensions, dark_mode=False, output_dir=None, max_workers=4, recycle_after=100,
+                 options=None, settle=WATCH_SETTLE_SECONDS, poll=False):
+    """Render emails as they arrive in a folder, on a warm browser pool, until interrupted.
+
+    Emails already in the folder whose outputs are missing or older than
+    the email are rendered first. After that only new or modified emails
+    are, as soon as they have settled. Outputs mirror the folder's layout,
+    as in batch mode.
+    """
+    import time
+
+    label = format_label(extensions)
+
+    try:
+        import playwright.sync_api
+    except ImportError:
+        install_playwright()
+        return
+
+    in_flight = {}
+
+    def finished(eml_file, future):
+        try:
+            output_files = future.result()
+        except Exception as e:
+            print(f"Error processing {os.path.basename(eml_file)}: {e}")
+            record_in_journal(options, eml_file, extensions, error=str(e))
+        else:
+            record_in_journal(options, eml_file, extensions, output_files)
+
+    watcher = FolderWatcher(folder_path, settle, poll)
+    with BrowserPool(max_workers, recycle_after, options) as pool:
+        error = pool.warm_up()
+        if error is not None:
+            print(f"Warning: could not start a browser, emails that need one will fail: {error}")
+        watcher.start()
+        backlog = 0
+        for eml_file in watcher.scan():
+            if not outputs_up_to_date(eml_file, extensions, mirrored_output_dir(eml_file, folder_path, output_dir),
+                                      options):
+                watcher.notice(eml_file)
+                backlog += 1
+        if backlog:
+            print(f"{backlog} emails in {folder_path} have no up-to-date {label} yet")
+        print(f"Watching {folder_path} for new emails to convert to {label} "
+              f"({'notifications' if watcher.observing else 'polling'}, {max_workers} workers; Ctrl-C to stop)")
+
+        rendered = 0
+        try:
+            while True:
+                time.sleep(WATCH_POLL_SECONDS)
+                if not watcher.observing:
+                    for eml_file in watcher.scan():
+                        watcher.notice(eml_file)
+                for eml_file in watcher.settled():
+                    future = in_flight.get(eml_file)
+                    if future is not None and not future.done():
+                        # Changed again while rendering: render once more afterwards
+                        watcher.notice(eml_file)
+                        continue
+                    print(f"Processing: {os.path.relpath(eml_file, folder_path)}")
+                    future = pool.submit(render_eml, eml_file, extensions, dark_mode,
+                                         mirrored_output_dir(eml_file, folder_path, output_dir), options)
+                    future.add_done_callback(lambda future, eml_file=eml_file: finished(eml_file, future))
+                    in_flight[eml_file] = future
+                done = [path for path, future in in_flight.items() if future.done()]
+                for eml_file in done:
+                    del in_flight[eml_file]
+                rendered += len(done)
+                if rendered >= RENDER_CACHE_EVICT_EVERY:
+                    evict_render_cache(options)
+                    rendered = 0
+        except KeyboardInterrupt:
+            print(f"Stopping, finishing {sum(not future.done() for future in in_flight.values())} emails in progress...")
+        finally:
+            watcher.stop()
+
+# Address of the render daemon when --server is not given
+DEFAULT_SERVE_ADDRESS = '127.0.0.1:8765'
+# Largest job request body the daemon accepts (uploaded emails are base64)
+MAX_JOB_BYTES = 256 * 1024 * 1024
+
+def parse_serve_address(address):
+    """('tcp', (host, port)) for 'host:port', '[ipv6]:port' or a bare port, else ('unix', socket path)"""
+    if address.isdigit():
+        return 'tcp', ('127.0.0.1', int(address))
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in host and os.sep not in host:
+        if host.startswith('[') and host.endswith(']'):
+            host = host[1:-1]
+        return 'tcp', (host, int(port))
+    return 'unix', address
+
+def is_loopback_host(host):
+    """True if every address host resolves to is a loopback address"""
+    import ipaddress
+    import socket
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host or None, None)}
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split('%')[0]).is_loopback
+                                   for address in addresses)
+
+def resolve_job_output_dir(output_dir, output_root=None):
+    """Check a job's output_dir and return it as a real absolute path.
+
+    It must be an absolute path to an existing directory, and when the
+    daemon was started with an output root, it must lie inside that root.
+    """
+    if not isinstance(output_dir, str) or not os.path.isabs(output_dir):
+        raise ValueError(f"output_dir must be an absolute path: {output_dir}")
+    resolved = os.path.realpath(output_dir)
+    if not os.path.isdir(resolved):
+        raise ValueError(f"no such output directory: {output_dir}")
+    if output_root is not None:
+        root = os.path.realpath(output_root)
+        if os.path.commonpath([root, resolved]) != root:
+            raise ValueError(f"output_dir must be inside {output_root}: {output_dir}")
+    return resolved
+
+def touch_page(page):
+    """A job that only opens a page, so the pool launches its browsers up front"""
+    return page.url
+
+def prepare_render_job(job, output_root=None):
+    """Validate a daemon job and return (eml_file, extensions, dark_mode, output_dir, return_bytes).
+
+    A job names an .eml file by "path", or uploads it base64-encoded as
+    "eml" (with an optional "name"). Uploaded emails always come back as
+    bytes unless the job also gives an "output_dir" on the daemon's side.
+    A path job without an "output_dir" writes next to its email. Output
+    folders are checked by resolve_job_output_dir against output_root.
+    """
+    import base64
+
+    if not isinstance(job, dict):
+        raise ValueError("a job must be a JSON object")
+    formats = job.get('formats') or ['pdf']
+    extensions = ['.' + str(fmt).strip().lower().lstrip('.') for fmt in formats]
+    unknown = [extension for extension in extensions if extension not in ('.html', '.pdf', '.png')]
+    if unknown:
+        raise ValueError(f"unknown formats: {', '.join(unknown)}")
+    output_dir = job.get('output_dir')
+    return_bytes = bool(job.get('return_bytes'))
+
+    if 'eml' in job:
+        data = base64.b64decode(job['eml'], validate=True)
+        name = os.path.basename(job.get('name') or 'message.eml')
+        if not name.endswith('.eml'):
+            name += '.eml'
+        eml_file = ArchivedEmail(name, 'upload', 'bytes', size=len(data), data=data)
+        return_bytes = return_bytes or not output_dir
+    elif 'path' in job:
+        eml_file = job['path']
+        if not isinstance(eml_file, str) or not os.path.isabs(eml_file):
+            raise ValueError(f"path must be an absolute path: {eml_file}")
+        if not eml_file.lower().endswith('.eml'):
+            # Outputs are written next to the input, so anything else could be overwritten
+            raise ValueError(f"path must name an .eml file: {eml_file}")
+        if not os.path.isfile(eml_file):
+            raise ValueError(f"no such file: {eml_file}")
+        output_dir = output_dir or os.path.dirname(eml_file)
+    else:
+        raise ValueError('a job needs a "path" or an "eml"')
+    if output_dir:
+        output_dir = resolve_job_output_dir(output_dir, output_root)
+    return eml_file, extensions, bool(job.get('dark')), output_dir, return_bytes
+
+def run_render_job(pool, prepared, options=None):
+    """Render one job, as returned by prepare_render_job, on the warm pool and return the JSON response"""
+    import base64
+    import shutil
+    import tempfile
+    import time
+
+    eml_file, extensions, dark_mode, output_dir, return_bytes = prepared
+    # Renders that are only sent back are written to a scratch folder
+    scratch = tempfile.mkdtemp(prefix='eml-render-') if return_bytes and not output_dir else None
+    try:
+        started = time.perf_counter()
+        outputs = pool.submit(render_eml, eml_file, extensions, dark_mode, output_dir or scratch, options).result()
+        response = {'outputs': [] if scratch else [os.path.abspath(path) for path in outputs],
+                    'seconds': round(time.perf_counter() - started, 3)}
+        if return_bytes:
+            files = {}
+            for path in outputs:
+                with open(path, 'rb') as f:
+                    files[os.path.basename(path)] = base64.b64encode(f.read()).decode('ascii')
+            response['files'] = files
+        return response
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+def serve_renders(address, max_workers=4, recycle_after=100, options=None, allow_remote=False, output_root=None):
+    """Keep a warm browser pool running and render jobs posted over HTTP.
+
+    The daemon listens on a Unix socket, or on a TCP port for 'host:port'
+    addresses. It has no authentication, so it refuses to listen on
+    anything but loopback unless allow_remote is set, and with output_root
+    it only writes inside that folder. POST /render takes a JSON
+    job (see prepare_render_job) and answers with the output paths and,
+    if asked, the files themselves. GET /health reports the pool's state.
+    Each request is handled on its own thread and waits for a free
+    browser, so up to max_workers emails render at once.
+    """
+    import http.server
+    import signal
+    import socket
+    import socketserver
+    import stat
+    import threading
+
+    kind, location = parse_serve_address(address)
+    if kind == 'tcp' and not allow_remote and not is_loopback_host(location[0]):
+        print(f"Error: refusing to serve on {address}, which is not a loopback address. "
+              "The daemon has no authentication; pass --allow-remote to listen there anyway.")
+        return
+    if output_root is not None and not os.path.isdir(output_root):
+        print(f"Error: output root not found: {output_root}")
+        return
+    jobs = 0
+    jobs_lock = threading.Lock()
+
+    with BrowserPool(max_workers, recycle_after, options) as pool:
+
+        class RenderRequestHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def address_string(self):
+                # Unix socket peers have no address
+                return self.client_address[0] if self.client_address else 'local'
+
+            def log_message(self, format, *args):
+                print(f"{self.address_string()} - {format % args}")
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != '/health':
+                    return self.reply(404, {'error': f"no such endpoint: {self.path}"})
+                self.reply(200, {'status': 'ok', 'workers': pool.size, 'browser_launches': pool.launches,
+                                 'jobs': jobs})
+
+            def do_POST(self):
+                nonlocal jobs
+                if self.path != '/render':
+                    return self.reply(404, {'error': f"no such endpoint: {self.path}"})
+                length = int(self.headers.get('Content-Length') or 0)
+                if length > MAX_JOB_BYTES:
+                    self.close_connection = True
+                    return self.reply(413, {'error': f"jobs are limited to {MAX_JOB_BYTES} bytes"})
                 try:
-                    result = future.result()
-                    if result:
-                        converted_files.append(result)
+                    prepared = prepare_render_job(json.loads(self.rfile.read(length) or b'null'), output_root)
+                except (ValueError, TypeError) as e:
+                    return self.reply(400, {'error': str(e)})
+                with jobs_lock:
+                    jobs += 1
+                    evict = jobs % RENDER_CACHE_EVICT_EVERY == 0
+                try:
+                    self.reply(200, run_render_job(pool, prepared, options))
                 except Exception as e:
-                    print(f"Error processing {os.path.basename(eml_file)}: {e}")
-                    
-    finally:
-        # Clean up server if it was started
-        if server_thread and server_thread.is_alive():
-            # The server will be cleaned up when the thread ends
+                    self.reply(500, {'error': f"{type(e).__name__}: {e}"})
+                if evict:
+                    evict_render_cache(options)
+
+        if kind == 'unix':
+            if os.path.exists(location) and stat.S_ISSOCK(os.stat(location).st_mode):
+                # Left behind by a daemon that did not shut down cleanly
+                os.unlink(location)
+
+            class RenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+                daemon_threads = True
+
+            server = RenderServer(location, RenderRequestHandler)
+            os.chmod(location, 0o600)
+        else:
+            class RenderServer(http.server.ThreadingHTTPServer):
+                address_family = socket.AF_INET6 if ':' in location[0] else socket.AF_INET
+
+            server = RenderServer(location, RenderRequestHandler)
+
+        # Stop cleanly on SIGTERM as well as Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+        print(f"Warming up {max_workers} browsers...")
+        error = pool.warm_up()
+        if error is not None:
+            print(f"Warning: could not start a browser, emails that need one will fail: {error}")
+        print(f"Serving renders on {address} (Ctrl-C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
             pass
-    
-    print(f"Successfully converted {len(converted_files)} files to PDF")
-    return converted_files
+        finally:
+            print("Shutting down render daemon")
+            server.server_close()
+            if kind == 'unix' and os.path.exists(location):
+                os.unlink(location)
 
-def batch_convert_to_png(folder_path, dark_mode=False, output_dir=None, max_workers=4):
-    """Convert all .eml files in a folder to PNG using concurrent processing"""
-    eml_files = get_eml_files_from_folder(folder_path)
-    
-    if not eml_files:
-        print(f"No .eml files found in {folder_path}")
-        return []
-    
-    print(f"Found {len(eml_files)} .eml files to convert to PNG (using {max_workers} workers)")
-    converted_files = []
-    
-    # Start shared HTTP server for dark mode if needed
-    server_thread = None
-    if dark_mode:
-        import http.server
-        import socketserver
-        import threading
-        import time
-        
-        def start_server():
-            PORT = 8000
-            Handler = http.server.SimpleHTTPRequestHandler
-            with socketserver.TCPServer(("", PORT), Handler) as httpd:
-                httpd.serve_forever()
-        
-        server_thread = threading.Thread(target=start_server, daemon=True)
-        server_thread.start()
-        time.sleep(2)
-    
+def render_via_daemon(eml_file, address=DEFAULT_SERVE_ADDRESS, extensions=('.pdf',), dark_mode=False,
+                      output_dir=None, upload=False, timeout=600):
+    """Have a running render daemon convert one email, instead of starting a browser here.
+
+    By default the daemon reads the email and writes the outputs itself, so
+    both sides must see the same filesystem. With upload, the email is sent
+    and the renders come back over the connection. Returns the files written.
+    """
+    import base64
+    import http.client
+    import socket
+
+    class UnixHTTPConnection(http.client.HTTPConnection):
+        def __init__(self, path):
+            super().__init__('localhost', timeout=timeout)
+            self.socket_path = path
+
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.socket_path)
+
+    # Outputs go where the one-shot command would put them: output_dir or the current directory
+    target_dir = os.path.abspath(output_dir or '.')
+    job = {'formats': [extension.lstrip('.') for extension in extensions], 'dark': dark_mode}
+    if upload:
+        with open(eml_file, 'rb') as f:
+            job['eml'] = base64.b64encode(f.read()).decode('ascii')
+        job['name'] = os.path.basename(eml_file)
+        job['return_bytes'] = True
+    else:
+        job['path'] = os.path.abspath(eml_file)
+        job['output_dir'] = target_dir
+
+    kind, location = parse_serve_address(address)
+    if kind == 'unix':
+        connection = UnixHTTPConnection(location)
+    else:
+        connection = http.client.HTTPConnection(*location, timeout=timeout)
     try:
-        # Use ThreadPoolExecutor for concurrent processing
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import threading
-        
-        # Shared counter for progress tracking
-        counter = 0
-        lock = threading.Lock()
-        
-        def convert_with_progress(eml_file):
-            nonlocal counter
-            with lock:
-                counter += 1
-                current = counter
-                total = len(eml_files)
-                print(f"Processing {current}/{total}: {os.path.basename(eml_file)}")
-            
-            result = convert_to_png(eml_file, dark_mode, output_dir, shared_server=dark_mode)
-            return result
-        
-        # Process files concurrently
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_file = {executor.submit(convert_with_progress, eml_file): eml_file for eml_file in eml_files}
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_file):
-                eml_file = future_to_file[future]
-                try:
-                    result = future.result()
-                    if result:
-                        converted_files.append(result)
-                except Exception as e:
-                    print(f"Error processing {os.path.basename(eml_file)}: {e}")
-                    
+        connection.request('POST', '/render', body=json.dumps(job), headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = json.loads(response.read() or b'{}')
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Error: cannot reach the render daemon at {address}: {e}")
+        return []
     finally:
-        # Clean up server if it was started
-        if server_thread and server_thread.is_alive():
-            # The server will be cleaned up when the thread ends
-            pass
-    
-    print(f"Successfully converted {len(converted_files)} files to PNG")
-    return converted_files
+        connection.close()
+    if response.status != 200:
+        print(f"Error from render daemon: {body.get('error', response.reason)}")
+        return []
 
-def convert_to_html(eml_file, dark_mode=False, output_dir=None):
-    """Convert .eml to HTML file"""
-    html_content = extract_html_from_eml(eml_file)
-    
-    if html_content:
-        # Get just the filename without path
-        eml_filename = os.path.basename(eml_file)
-        output_filename = eml_filename.replace('.eml', '.html')
-        
-        # Use output directory if specified
-        if output_dir:
-            os.makedirs(output_dir, exist_ok=True)
-            output_filename = os.path.join(output_dir, output_filename)
-        
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        print(f"Converted {eml_file} to {output_filename}")
-        return output_filename
+    outputs = body.get('outputs', [])
+    if upload:
+        os.makedirs(target_dir, exist_ok=True)
+        outputs = []
+        for name, data in body.get('files', {}).items():
+            path = os.path.join(target_dir, os.path.basename(name))
+            with atomic_output(path) as temp_path:
+                with open(temp_path, 'wb') as f:
+                    f.write(base64.b64decode(data))
+            outputs.append(path)
+    if outputs:
+        print(f"Converted {eml_file} to {', '.join(outputs)} (rendered by daemon in {body.get('seconds', 0):.2f}s)")
     else:
         print(f"No HTML content found in {eml_file}")
-        return None
+    return outputs
 
-def convert_to_pdf(eml_file, dark_mode=False, output_dir=None, shared_server=False):
+def convert_to_pdf(eml_file, dark_mode=False, output_dir=None, options=None):
     """Convert .eml to PDF using browser rendering (Edge-like)"""
     try:
         from playwright.sync_api import sync_playwright
-        import tempfile
         
-        # Extract HTML content and create temporary HTML file
-        html_content = extract_html_from_eml(eml_file)
-        if not html_content:
-            print(f"No HTML content found in {eml_file}")
-            return None
+        with stage_span(options, eml_file, 'email'):
+            # Extract HTML content and inline images
+            with stage_span(options, eml_file, 'parse'):
+                content = extract_email_content(eml_file)
+            if not content.html:
+                print(f"No HTML content found in {eml_file}")
+                return None
         
-        # Create temporary HTML file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as temp_html:
-            temp_html.write(html_content)
-            temp_html_path = temp_html.name
+            # An unchanged email needs no browser at all
+            restored, missing, keys = restore_cached_renders(content, eml_file, ['.pdf'], dark_mode, output_dir, options)
+            if restored:
+                print(f"Converted {eml_file} to {restored[0]}{describe_conversion(None, restored)}")
+                return restored[0]
         
-        # For dark mode, copy the temp file to current directory so HTTP server can serve it
-        if dark_mode:
-            import shutil
-            local_temp_path = os.path.join(os.getcwd(), f"temp_{os.path.basename(temp_html_path)}")
-            shutil.copy2(temp_html_path, local_temp_path)
-            temp_html_path = local_temp_path
+            slimmed = None
+            if options is not None and options.slim:
+                content, slimmed = slim_email_content(content)
         
-        # Use Playwright to render like Edge and save as PDF
-        with sync_playwright() as p:
-            if dark_mode and not shared_server:
-                # Use Chrome with local server for dark mode
-                import http.server
-                import socketserver
-                import threading
-                import time
-                
-                # Start local server for dark mode
-                def start_server():
-                    PORT = 8000
-                    Handler = http.server.SimpleHTTPRequestHandler
-                    with socketserver.TCPServer(("", PORT), Handler) as httpd:
-                        httpd.serve_forever()
-                
-                server_thread = threading.Thread(target=start_server, daemon=True)
-                server_thread.start()
-                time.sleep(2)
-                
-                browser = p.chromium.launch_persistent_context(
-                    user_data_dir="./browser_data",
-                    headless=True,
-                    args=[
-                        "--allow-running-insecure-content",
-                        "--disable-web-security"
-                    ]
-                )
-                page = browser.new_page()
-            else:
-                # Regular browser for light mode
-                browser = p.chromium.launch()
+            # Neither does plain text or simple HTML
+            text = typeset_source(content, options)
+            if text is not None:
+                with stage_span(options, eml_file, 'typeset'):
+                    pdf_filename = save_text_as_pdf(text, eml_file, dark_mode, output_dir)
+                store_cached_renders(keys, [pdf_filename], options)
+                print(f"Converted {eml_file} to {pdf_filename}"
+                      f"{describe_conversion('typeset without a browser', [], slimmed)}")
+                return pdf_filename
+        
+            # Use Playwright to render like Edge and save as PDF
+            with sync_playwright() as p:
+                # Dark mode is applied per page, so both modes use a plain browser
+                with stage_span(options, None, 'browser_launch'):
+                    browser = p.chromium.launch()
                 page = browser.new_page()
             
-            # Load the HTML file
-            if dark_mode:
-                # Use HTTP server for Dark Reader - only use the filename, not the full path
-                page.goto(f'http://localhost:8000/{os.path.basename(temp_html_path)}', wait_until='domcontentloaded')
-            else:
-                # Use file:// for regular mode
-                page.goto(f'file://{os.path.abspath(temp_html_path)}', wait_until='domcontentloaded')
-            
-            # Wait for content to load with shorter timeout and fallback
-            try:
-                page.wait_for_load_state('networkidle', timeout=10000)
-            except:
-                # If networkidle times out, try domcontentloaded instead
-                try:
-                    page.wait_for_load_state('domcontentloaded', timeout=5000)
-                except:
-                    # If that also fails, just wait a bit and continue
-                    page.wait_for_timeout(2000)
-            
-            # Enable dark mode if requested
-            if dark_mode:
-                # Apply CSS-based dark mode
-                page.evaluate("""
-                    // Apply CSS-based dark mode
-                    console.log('Applying CSS-based dark mode...');
-                    const style = document.createElement('style');
-                    style.id = 'force-dark-mode';
-                    style.textContent = `
-                        html { filter: invert(1) hue-rotate(180deg) !important; }
-                        img, video, picture, svg { filter: invert(1) hue-rotate(180deg) !important; }
-                        [style*="background"] { filter: invert(1) hue-rotate(180deg) !important; }
-                    `;
-                    document.head.appendChild(style);
-                    console.log('CSS-based dark mode applied');
-                """)
-                # Wait for dark mode to apply
-                page.wait_for_timeout(2000)
-                
-                # Before PDF generation, inject print-friendly dark CSS
-                page.evaluate("""
-                    console.log('Adding print-friendly dark mode CSS...');
-                    
-                    // Remove any conflicting styles
-                    const existingStyles = document.querySelectorAll('#force-dark-mode, #dark-mode-fallback');
-                    existingStyles.forEach(style => style.remove());
-                    
-                    // Add CSS that works specifically for print/PDF
-                    const printStyle = document.createElement('style');
-                    printStyle.id = 'print-dark-mode';
-                    printStyle.textContent = `
-                        @media screen, print {
-                            html, body {
-                                background-color: #1a1a1a !important;
-                                color: #ffffff !important;
-                                filter: invert(1) hue-rotate(180deg) !important;
-                            }
-                            
-                            /* Force all text to be white */
-                            *, p, span, div, td, th, h1, h2, h3, h4, h5, h6 {
-                                color: #ffffff !important;
-                                background-color: transparent !important;
-                            }
-                            
-                            /* Keep images normal - don't invert them */
-                            img, video, picture, svg, canvas {
-                                filter: none !important;
-                            }
-                            
-                            /* Force browsers to print background colors */
-                            * {
-                                -webkit-print-color-adjust: exact !important;
-                                color-adjust: exact !important;
-                                print-color-adjust: exact !important;
-                            }
-                        }
-                    `;
-                    document.head.appendChild(printStyle);
-                    console.log('Print-friendly dark mode CSS added');
-                """)
-                page.wait_for_timeout(2000)
-            
-            # Generate PDF with Edge-like settings
-            eml_filename = os.path.basename(eml_file)
-            pdf_filename = eml_filename.replace('.eml', '.pdf')
-            
-            # Use output directory if specified
-            if output_dir:
-                os.makedirs(output_dir, exist_ok=True)
-                pdf_filename = os.path.join(output_dir, pdf_filename)
-            
-            page.pdf(
-                path=pdf_filename,
-                format='A4',
-                print_background=True,
-                prefer_css_page_size=False
-            )
-            
-            browser.close()
-            
-        # Clean up temporary HTML file
-        try:
-            os.unlink(temp_html_path)
-            # Also clean up the local copy if it was created
-            if dark_mode and temp_html_path != temp_html.name:
-                try:
-                    os.unlink(temp_html.name)
-                except:
-                    pass
-        except:
-            pass
+                readiness = load_email_into_page(page, content, dark_mode, options, eml_file)
+                with stage_span(options, eml_file, 'pdf'):
+                    pdf_filename = save_page_as_pdf(page, eml_file, output_dir)
             
-        print(f"Converted {eml_file} to {pdf_filename}")
-        return pdf_filename
+                browser.close()
+        
+            store_cached_renders(keys, [pdf_filename], options)
+            print(f"Converted {eml_file} to {pdf_filename}{describe_conversion(readiness, [], slimmed)}")
+            return pdf_filename
         
     except ImportError:
-        print("Playwright not installed. Installing...")
-        os.system("pip install playwright")
-        os.system("playwright install chromium")
-        print("Please run the script again.")
+        install_playwright()
         return None
     except Exception as e:
         print(f"Error creating PDF: {e}")
         return None
 
-def convert_to_png(eml_file, dark_mode=False, output_dir=None, shared_server=False):
+def convert_to_png(eml_file, dark_mode=False, output_dir=None, options=None):
     """Convert .eml to PNG screenshot using browser rendering"""
     try:
         from playwright.sync_api import sync_playwright
-        import tempfile
         
-        # Extract HTML content and create temporary HTML file
-        html_content = extract_html_from_eml(eml_file)
-        if not html_content:
-            print(f"No HTML content found in {eml_file}")
-            return None
+        with stage_span(options, eml_file, 'email'):
+            # Extract HTML content and inline images
+            with stage_span(options, eml_file, 'parse'):
+                content = extract_email_content(eml_file)
+            if not content.html:
+                print(f"No HTML content found in {eml_file}")
+                return None
         
-        # Create temporary HTML file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as temp_html:
-            temp_html.write(html_content)
-            temp_html_path = temp_html.name
+            # An unchanged email needs no browser at all
+            restored, missing, keys = restore_cached_renders(content, eml_file, ['.png'], dark_mode, output_dir, options)
+            if restored:
+                print(f"Converted {eml_file} to {restored[0]}{describe_conversion(None, restored)}")
+                return restored[0]
         
-        # For dark mode, copy the temp file to current directory so HTTP server can serve it
-        if dark_mode:
-            import shutil
-            local_temp_path = os.path.join(os.getcwd(), f"temp_{os.path.basename(temp_html_path)}")
-            shutil.copy2(temp_html_path, local_temp_path)
-            temp_html_path = local_temp_path
+            slimmed = None
+            if options is not None and options.slim:
+                content, slimmed = slim_email_content(content)
         
-        # Use Playwright to render like Edge and save as PNG
-        with sync_playwright() as p:
-            if dark_mode and not shared_server:
-                # Use Chrome with local server for dark mode
-                import http.server
-                import socketserver
-                import threading
-                import time
-                
-                # Start local server for dark mode
-                def start_server():
-                    PORT = 8000
-                    Handler = http.server.SimpleHTTPRequestHandler
-                    with socketserver.TCPServer(("", PORT), Handler) as httpd:
-                        httpd.serve_forever()
-                
-                server_thread = threading.Thread(target=start_server, daemon=True)
-                server_thread.start()
-                time.sleep(2)
-                
-                browser = p.chromium.launch_persistent_context(
-                    user_data_dir="./browser_data",
-                    headless=True,
-                    args=[
-                        "--allow-running-insecure-content",
-                        "--disable-web-security"
-                    ]
-                )
-                page = browser.new_page()
-            else:
-                # Regular browser for light mode
-                browser = p.chromium.launch()
+            # Use Playwright to render like Edge and save as PNG
+            with sync_playwright() as p:
+                # Dark mode is applied per page, so both modes use a plain browser
+                with stage_span(options, None, 'browser_launch'):
+                    browser = p.chromium.launch()
                 page = browser.new_page()
             
-            # Load the HTML file
-            if dark_mode:
-                # Use HTTP server for Dark Reader - only use the filename, not the full path
-                page.goto(f'http://localhost:8000/{os.path.basename(temp_html_path)}', wait_until='domcontentloaded')
-            else:
-                # Use file:// for regular mode
-                page.goto(f'file://{os.path.abspath(temp_html_path)}', wait_until='domcontentloaded')
+                readiness = load_email_into_page(page, content, dark_mode, options, eml_file)
+                with stage_span(options, eml_file, 'screenshot'):
+                    png_files = save_page_as_png(page, eml_file, dark_mode, output_dir, options)
             
-            # Wait for content to load with shorter timeout and fallback
-            try:
-                page.wait_for_load_state('networkidle', timeout=10000)
-            except:
-                # If networkidle times out, try domcontentloaded instead
-                try:
-                    page.wait_for_load_state('domcontentloaded', timeout=5000)
-                except:
-                    # If that also fails, just wait a bit and continue
-                    page.wait_for_timeout(2000)
+                browser.close()
+        
+            store_cached_renders(keys, png_files, options)
+            print(f"Converted {eml_file} to {', '.join(png_files)}{describe_conversion(readiness, [], slimmed)}")
+            # The first band when the capture was tiled
+            return png_files[0]
+        
+    except ImportError:
+        install_playwright()
+        return None
+    except Exception as e:
+        print(f"Error creating PNG: {e}")
+        return None
 
-            # Enable dark mode if requested
+THREAD_STYLESHEET = """
+    body { margin: 0; font-family: Arial, Helvetica, sans-serif; }
+    .thread-message + .thread-message { break-before: page; }
+    .thread-header {
+        border-bottom: 1px solid #999999;
+        margin-bottom: 12px;
+        padding: 8px 0;
+        font-size: 12px;
+        break-inside: avoid;
+    }
+    .thread-header th { text-align: left; padding-right: 12px; vertical-align: top; white-space: nowrap; }
+"""
+
+def compose_thread_document(eml_files, dark_mode=False):
+    """Compose several emails into one paginated EmailContent, oldest first.
+
+    Each email gets a header block and starts on a new page. Its HTML is
+    placed in a declarative shadow root, so every email keeps its own styles
+    without leaking them into the others. Inline resources are served under
+    a per-email prefix, so equal Content-IDs or Content-Locations in
+    different emails do not collide.
+    """
+    import html
+
+    messages = []
+    for eml_file in eml_files:
+        headers = extract_email_headers(eml_file)
+        messages.append((get_email_date(headers), eml_file, headers))
+    # Undated emails last, in the same order as PDFSorterMerger's merged PDFs
+    messages.sort(key=lambda message: (message[0] is None, message[0] or 0, message[1]))
+
+    sections = []
+    resources = {}
+    for index, (date, eml_file, headers) in enumerate(messages):
+        content = extract_email_content(eml_file, resource_prefix=f'/thread/{index}')
+        for url, resource in content.resources.items():
+            resources.setdefault(url, resource)
+
+        rows = "".join(
+            f"<tr><th>{name}:</th><td>{html.escape(str(headers[name]))}</td></tr>"
+            for name in ('From', 'To', 'Cc', 'Date', 'Subject') if headers.get(name)
+        )
+        if content.html:
+            body = content.html.replace('</template', '&lt;/template')
             if dark_mode:
-                # Apply CSS-based dark mode
-                page.evaluate("""
-                    // Apply CSS-based dark mode
-                    console.log('Applying CSS-based dark mode...');
-                    const style = document.createElement('style');
-                    style.id = 'force-dark-mode';
-                    style.textContent = `
-                        html { filter: invert(1) hue-rotate(180deg) !important; }
-                        img, video, picture, svg { filter: invert(1) hue-rotate(180deg) !important; }
-                        [style*="background"] { filter: invert(1) hue-rotate(180deg) !important; }
-                    `;
-                    document.head.appendChild(style);
-                    console.log('CSS-based dark mode applied');
-                """)
-                page.wait_for_timeout(2000)
-                
-                # Before screenshot, inject print-friendly dark CSS
-                # This ensures the screenshot captures the dark mode
-                page.evaluate("""
-                    console.log('Adding print-friendly dark mode CSS for screenshot...');
-                    
-                    // Remove any conflicting styles
-                    const existingStyles = document.querySelectorAll('#force-dark-mode, #dark-mode-fallback');
-                    existingStyles.forEach(style => style.remove());
-                    
-                    // Add CSS that works specifically for screenshots
-                    const printStyle = document.createElement('style');
-                    printStyle.id = 'print-dark-mode';
-                    printStyle.textContent = `
-                        @media screen, print {
-                            html, body {
-                                background-color: #1a1a1a !important;
-                                color: #ffffff !important;
-                                filter: invert(1) hue-rotate(180deg) !important;
-                            }
-                            
-                            /* Force all text to be white */
-                            *, p, span, div, td, th, h1, h2, h3, h4, h5, h6 {
-                                color: #ffffff !important;
-                                background-color: transparent !important;
-                            }
-                            
-                            /* Keep images normal - don't invert them */
-                            img, video, picture, svg, canvas {
-                                filter: none !important;
-                            }
-                            
-                            /* Force browsers to print background colors */
-                            * {
-                                -webkit-print-color-adjust: exact !important;
-                                color-adjust: exact !important;
-                                print-color-adjust: exact !important;
-                            }
-                        }
-                    `;
-                    document.head.appendChild(printStyle);
-                    console.log('Print-friendly dark mode CSS added for screenshot');
-                """)
-                page.wait_for_timeout(2000)
-                
-                # Set viewport to match content size (remove white borders)
-                content_size = page.evaluate("""
-                    ({
-                        width: document.documentElement.scrollWidth,
-                        height: document.documentElement.scrollHeight
-                    })
-                """)
-                page.set_viewport_size({
-                    'width': content_size['width'],
-                    'height': content_size['height']
-                })
-                
-                # Force dark background on body and html to eliminate any white borders
-                page.evaluate("""
-                    document.documentElement.style.margin = '0';
-                    document.documentElement.style.padding = '0';
-                    document.body.style.margin = '0';
-                    document.body.style.padding = '0';
-                    document.documentElement.style.backgroundColor = '#1a1a1a';
-                    document.body.style.backgroundColor = '#1a1a1a';
-                """)
-            
-            # Take screenshot
-            eml_filename = os.path.basename(eml_file)
-            png_filename = eml_filename.replace('.eml', '.png')
-            
-            # Use output directory if specified
-            if output_dir:
-                os.makedirs(output_dir, exist_ok=True)
-                png_filename = os.path.join(output_dir, png_filename)
-            
-            page.screenshot(path=png_filename, full_page=True)
-            
+                # Document stylesheets do not reach into shadow roots
+                body = f"<style>{DARK_MODE_STYLESHEET}</style>{body}"
+        else:
+            body = f"<p>No HTML content found in {html.escape(os.path.basename(eml_file))}</p>"
+        sections.append(
+            f'<article class="thread-message"><header class="thread-header"><table>{rows}</table></header>'
+            f'<div class="thread-body"><template shadowrootmode="open">{body}</template></div></article>'
+        )
+
+    document = (f'<!DOCTYPE html><html><head><meta charset="utf-8"><style>{THREAD_STYLESHEET}</style></head>'
+                f'<body>{"".join(sections)}</body></html>')
+    return EmailContent(document, resources)
+
+def convert_thread_to_pdf(folder_path, output_path=None, dark_mode=False, output_dir=None, options=None):
+    """Render a conversation's emails into one PDF with a single page load and a single page.pdf call"""
+    eml_files = get_eml_files_from_folder(folder_path)
+    if not eml_files:
+        print(f"No .eml files found in {folder_path}")
+        return None
+
+    if not output_path:
+        output_path = os.path.join(output_dir or '.', 'merged_emails.pdf')
+    output_parent = os.path.dirname(output_path)
+    if output_parent:
+        os.makedirs(output_parent, exist_ok=True)
+
+    try:
+        from playwright.sync_api import sync_playwright
+
+        print(f"Composing {len(eml_files)} emails into one document")
+        content = compose_thread_document(eml_files, dark_mode)
+        with sync_playwright() as p:
+            browser = p.chromium.launch()
+            page = browser.new_page()
+            readiness = load_email_into_page(page, content, dark_mode, options)
+            with atomic_output(output_path) as temp_path:
+                page.pdf(path=temp_path, **PDF_OPTIONS)
             browser.close()
-            
-        # Clean up temporary HTML file
-        try:
-            os.unlink(temp_html_path)
-            # Also clean up the local copy if it was created
-            if dark_mode and temp_html_path != temp_html.name:
-                try:
-                    os.unlink(temp_html.name)
-                except:
-                    pass
-        except:
-            pass
-            
-        print(f"Converted {eml_file} to {png_filename}")
-        return png_filename
-        
+
+        print(f"Rendered {len(eml_files)} emails into {output_path} ({readiness})")
+        return output_path
+
     except ImportError:
-        print("Playwright not installed. Installing...")
-        os.system("pip install playwright")
-        os.system("playwright install chromium")
-        print("Please run the script again.")
+        install_playwright()
         return None
     except Exception as e:
-        print(f"Error creating PNG: {e}")
+        print(f"Error creating thread PDF: {e}")
         return None
 
+def get_cli_option(name, default=None):
+    """Return the value that follows `name` on the command line, or default"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+def get_int_cli_option(name, default, minimum=1):
+    """Parse an integer command-line option, falling back to default if invalid"""
+    value = get_cli_option(name)
+    if value is None:
+        return default
+    try:
+        return max(minimum, int(value))
+    except ValueError:
+        print(f"Warning: Invalid {name.lstrip('-')} value, using default ({default})")
+        return default
+
+def evict_render_cache(options):
+    """Trim the render cache to its size cap, after a run or every few renders of --watch and --serve"""
+    cache = options.render_cache if options is not None else None
+    if cache is None or not cache.max_bytes:
+        return
+    removed, freed = cache.evict()
+    if removed:
+        print(f"Render cache: evicted {removed} least recently used renders ({freed / (1024 * 1024):.1f} MiB)")
+
+def finish_run(options):
+    """Housekeeping once a command is over: cache eviction, final metrics and profile"""
+    evict_render_cache(options)
+    if options.telemetry is not None:
+        options.telemetry.close()
+        if options.telemetry.spans_path:
+            print(f"Stage spans written to {options.telemetry.spans_path}")
+        if options.telemetry.metrics_path:
+            print(f"Metrics written to {options.telemetry.metrics_path}")
+    if options.profile:
+        collect_profiles(options)
+
 def main():
     if len(sys.argv) < 3:
         print("Usage:")
@@ -610,13 +3587,53 @@ def main():
         print("    python eml-to-pdf-render.py --png <eml_file> [--dark] [--output-dir <dir>]")
         print("  Batch processing:")
         print("    python eml-to-pdf-render.py --batch-html <folder_path> [--dark] [--output-dir <dir>] [--workers <num>]")
-        print("    python eml-to-pdf-render.py --batch-pdf <folder_path> [--dark] [--output-dir <dir>] [--workers <num>]")
-        print("    python eml-to-pdf-render.py --batch-png <folder_path> [--dark] [--output-dir <dir>] [--workers <num>]")
+        print("    python eml-to-pdf-render.py --batch-pdf <folder_path> [--dark] [--output-dir <dir>] [--workers <num>] [--recycle-after <num>] [--engine async|processes]")
+        print("    python eml-to-pdf-render.py --batch-png <folder_path> [--dark] [--output-dir <dir>] [--workers <num>] [--recycle-after <num>] [--engine async|processes]")
+        print("    python eml-to-pdf-render.py --batch-all <folder_path> [--formats html,pdf,png] [--dark] [--output-dir <dir>] [--workers <num>]")
+        print("  Watch folder:")
+        print("    python eml-to-pdf-render.py --watch <folder_path> [--formats pdf,png] [--dark] [--output-dir <dir>] [--workers <num>] [--settle <seconds>] [--poll]")
+        print("  Render daemon:")
+        print("    python eml-to-pdf-render.py --serve <socket_path|host:port> [--workers <num>] [--recycle-after <num>] [--output-root <dir>] [--allow-remote]")
+        print("    python eml-to-pdf-render.py --client <eml_file> [--server <socket_path|host:port>] [--formats pdf,png] [--dark] [--output-dir <dir>] [--upload]")
+        print("  Conversation rendering:")
+        print("    python eml-to-pdf-render.py --thread-pdf <folder_path> [--output <file>] [--dark] [--output-dir <dir>]")
         print("")
         print("Options:")
         print("  --dark          Enable dark mode")
         print("  --output-dir    Specify output directory")
         print("  --workers       Number of concurrent workers (default: 4)")
+        print("  --formats       Formats written by --batch-all (default: html,pdf,png), --watch and --client (default: pdf)")
+        print("  --recycle-after Relaunch each pooled browser after this many renders (default: 100)")
+        print("  --engine        Batch engine: threads (default), async or processes")
+        print("  --concurrency   Pages in flight at once with --engine async (default: 64)")
+        print("  --browsers      Browsers shared by the async engine (default: 1)")
+        print("  --processes     Worker processes, each with its own browser, for --engine processes (default: CPU count)")
+        print("  --ready-timeout Max milliseconds to wait for fonts and images before rendering (default: 10000)")
+        print("  --asset-cache   Directory for a shared on-disk cache of remote images, fonts and stylesheets")
+        print("  --block-trackers Stub out tracking pixels and analytics requests")
+        print("  --blocklist     File of extra hosts/URL fragments to block, one per line")
+        print("  --offline       Render from the asset cache only, never touching the network")
+        print("  --render-cache  Directory caching finished PDFs/PNGs; unchanged emails are linked, not re-rendered")
+        print("  --render-cache-max-mb Evict least recently used renders beyond this size (default: unlimited)")
+        print("  --lightweight   Typeset simple HTML emails to PDF with reportlab instead of a browser")
+        print("  --slim          Strip scripts, tracking pixels and hidden content and downscale huge inline images before rendering")
+        print("  --dedup         Render repeated copies of a message once, link the rest and write duplicates.csv")
+        print("  --journal       SQLite file recording the outcome of every email in a batch")
+        print("  --resume        Skip emails the journal records as done and retry failed ones")
+        print("  --max-attempts  Failed attempts after which --resume gives up on an email (default: 3)")
+        print("  --settle        Seconds a watched email must stop changing before it is converted (default: 2)")
+        print("  --poll          Watch by polling file sizes and mtimes, even if watchdog is installed")
+        print("  --server        Address of the render daemon used by --client (default: 127.0.0.1:8765)")
+        print("  --output-root   Folder the render daemon may write into; jobs naming another output_dir are refused")
+        print("  --allow-remote  Let --serve listen on a non-loopback address (the daemon has no authentication)")
+        print("  --upload        Send the email to the daemon and receive the renders back, for daemons on another filesystem")
+        print("  --max-height    Screenshot pages taller than this many pixels in bands of that height, bounding memory")
+        print("  --tiles         Write the bands of tall pages as numbered images instead of one stitched PNG")
+        print("  --image-format  Screenshot format: png (default), jpeg or webp; tall JPEG/WebP pages are written as tiles")
+        print("  --image-quality JPEG/WebP quality from 1 to 100 (default: 85)")
+        print("  --spans         Append a JSON line per email stage (parse, launch, goto, waits, pdf, ...) to this file")
+        print("  --metrics       Prometheus textfile of stage histograms, in-flight emails, browser launches and failures")
+        print("  --profile       Write merged cProfile stats of the Python side to this file")
         return
     
     option = sys.argv[1]
@@ -650,31 +3667,143 @@ def main():
             print("Warning: Invalid workers value, using default (4)")
             max_workers = 4
     
+    # Parse browser pool and engine options
+    recycle_after = get_int_cli_option("--recycle-after", 100)
+    engine = get_cli_option("--engine", "threads")
+    if engine not in ("threads", "async", "processes"):
+        print(f"Warning: Unknown engine '{engine}', using threads")
+        engine = "threads"
+    concurrency = get_int_cli_option("--concurrency", 64)
+    browsers = get_int_cli_option("--browsers", 1)
+    processes = get_int_cli_option("--processes", os.cpu_count() or 1)
+    
+    # Parse remote asset options
+    assets = None
+    asset_cache_dir = get_cli_option("--asset-cache")
+    blocklist_file = get_cli_option("--blocklist")
+    offline = "--offline" in sys.argv
+    if asset_cache_dir or blocklist_file or offline or "--block-trackers" in sys.argv:
+        blocklist = list(DEFAULT_BLOCKLIST)
+        if blocklist_file:
+            blocklist += load_blocklist(blocklist_file)
+        assets = RemoteAssets(AssetCache(asset_cache_dir) if asset_cache_dir else None, offline, blocklist)
+    
+    # Parse render cache options
+    render_cache = None
+    render_cache_dir = get_cli_option("--render-cache")
+    if render_cache_dir:
+        max_mb = get_int_cli_option("--render-cache-max-mb", 0, minimum=0)
+        render_cache = RenderCache(render_cache_dir, max_mb * 1024 * 1024 or None)
+    
+    # Parse job journal options. --resume alone uses a journal in the output
+    # directory, or next to the input emails
+    journal = None
+    journal_path = get_cli_option("--journal")
+    resume = "--resume" in sys.argv
+    if journal_path or resume:
+        if not journal_path:
+            journal_dir = output_dir or (target_path if os.path.isdir(target_path) else os.path.dirname(target_path))
+            journal_path = os.path.join(journal_dir or '.', '.eml-render-journal.sqlite')
+        journal = JobJournal(journal_path, resume, get_int_cli_option("--max-attempts", 3))
+    
+    # Parse screenshot format
+    image_format = get_cli_option("--image-format", "png").lower().replace("jpg", "jpeg")
+    if image_format not in IMAGE_EXTENSIONS:
+        print(f"Warning: Unknown image format '{image_format}', using png")
+        image_format = "png"
+    
+    # Parse rendering options
+    options = RenderOptions(
+        ready_timeout=get_int_cli_option("--ready-timeout", 10000),
+        assets=assets,
+        render_cache=render_cache,
+        journal=journal,
+        lightweight="--lightweight" in sys.argv,
+        slim="--slim" in sys.argv,
+        dedup="--dedup" in sys.argv,
+        max_height=get_int_cli_option("--max-height", 0, minimum=0) or None,
+        tiles="--tiles" in sys.argv,
+        image_format=image_format,
+        image_quality=min(get_int_cli_option("--image-quality", 85), 100),
+    )
+    
+    # Parse telemetry options
+    spans_path = get_cli_option("--spans")
+    metrics_path = get_cli_option("--metrics")
+    if spans_path or metrics_path:
+        options.telemetry = Telemetry(spans_path, metrics_path)
+    options.profile = get_cli_option("--profile")
+    
+    # Parse output formats, shared by --batch-all, --watch and --client
+    formats = [fmt.strip().lower() for fmt in
+               get_cli_option("--formats", "html,pdf,png" if option == "--batch-all" else "pdf").split(",")]
+    unknown = [fmt for fmt in formats if fmt not in ('html', 'pdf', 'png')]
+    if unknown and option in ("--batch-all", "--watch", "--client"):
+        print(f"Warning: Ignoring unknown formats: {', '.join(unknown)}")
+    formats = [fmt for fmt in ('html', 'pdf', 'png') if fmt in formats]
+    if not formats and option in ("--batch-all", "--watch", "--client"):
+        print("No valid formats requested. Use any of html, pdf, png")
+        return
+    
+    with profiled(options, f"{os.getpid()}-main"):
+        run_command(option, target_path, dark_mode, output_dir, max_workers, recycle_after, engine, concurrency,
+                    browsers, processes, options, formats)
+    finish_run(options)
+
+def run_command(option, target_path, dark_mode, output_dir, max_workers, recycle_after, engine, concurrency,
+                browsers, processes, options, formats=('pdf',)):
+    """Dispatch the parsed command line to the matching conversion"""
+    # Handle the render daemon, whose target is an address rather than a path
+    if option == "--serve":
+        serve_renders(target_path, max_workers, recycle_after, options, "--allow-remote" in sys.argv,
+                      get_cli_option("--output-root"))
+        return
+    
     if not os.path.exists(target_path):
         print(f"Path not found: {target_path}")
         return
     
+    if option == "--watch":
+        watch_folder(target_path, ['.' + fmt for fmt in formats], dark_mode, output_dir, max_workers, recycle_after,
+                     options, get_int_cli_option("--settle", WATCH_SETTLE_SECONDS, minimum=0), "--poll" in sys.argv)
+        return
+    
+    if option == "--client":
+        render_via_daemon(target_path, get_cli_option("--server", DEFAULT_SERVE_ADDRESS),
+                          ['.' + fmt for fmt in formats], dark_mode, output_dir, "--upload" in sys.argv)
+        return
+    
     # Handle batch processing
     if option.startswith("--batch-"):
         if option == "--batch-html":
-            batch_convert_to_html(target_path, dark_mode, output_dir)
+            batch_convert_to_html(target_path, dark_mode, output_dir, options)
         elif option == "--batch-pdf":
-            batch_convert_to_pdf(target_path, dark_mode, output_dir, max_workers)
+            batch_convert_to_pdf(target_path, dark_mode, output_dir, max_workers, recycle_after,
+                                 engine, concurrency, browsers, options, processes)
         elif option == "--batch-png":
-            batch_convert_to_png(target_path, dark_mode, output_dir, max_workers)
+            batch_convert_to_png(target_path, dark_mode, output_dir, max_workers, recycle_after,
+                                 engine, concurrency, browsers, options, processes)
+        elif option == "--batch-all":
+            batch_convert_all(target_path, formats, dark_mode, output_dir, max_workers, recycle_after,
+                              engine, concurrency, browsers, options, processes)
         else:
-            print("Invalid batch option. Use --batch-html, --batch-pdf, or --batch-png")
+            print("Invalid batch option. Use --batch-html, --batch-pdf, --batch-png, or --batch-all")
+        return
+    
+    # Handle conversation rendering
+    if option == "--thread-pdf":
+        convert_thread_to_pdf(target_path, get_cli_option("--output"), dark_mode, output_dir, options)
         return
     
     # Handle single file processing
     if option == "--html":
         convert_to_html(target_path, dark_mode, output_dir)
     elif option == "--pdf":
-        convert_to_pdf(target_path, dark_mode, output_dir)
+        convert_to_pdf(target_path, dark_mode, output_dir, options)
     elif option == "--png":
-        convert_to_png(target_path, dark_mode, output_dir)
+        convert_to_png(target_path, dark_mode, output_dir, options)
     else:
-        print("Invalid option. Use --html, --pdf, --png, --batch-html, --batch-pdf, or --batch-png")
+        print("Invalid option. Use --html, --pdf, --png, --batch-html, --batch-pdf, --batch-png, --batch-all, --thread-pdf, --watch, --serve or --client")
 
 if __name__ == "__main__":
     main()
@@ -3,15 +3,343 @@
 import os
 import re
 import glob
-from typing import List, Tuple
-from PyPDF2 import PdfMerger
+import hashlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from PyPDF2 import PdfMerger, PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+
+class atomic_output:
+    """Context manager yielding a temporary path next to `path` that is renamed to it on success.
+
+    A merge that fails or is interrupted removes the temporary file, so it
+    never leaves a truncated PDF under the final name.
+    """
+
+    def __init__(self, path: str):
+        import uuid
+
+        directory, filename = os.path.split(path)
+        self.path = path
+        self.temp_path = os.path.join(directory, f".tmp-{uuid.uuid4().hex[:12]}-{filename}")
+
+    def __enter__(self) -> str:
+        return self.temp_path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            os.replace(self.temp_path, self.path)
+        elif os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)
+
+
+class _PendingObject:
+    """Placeholder for an object that is being copied, used to break reference cycles"""
+    __slots__ = ("number",)
+
+    def __init__(self):
+        self.number: Optional[int] = None
+
+
+class StreamingPdfWriter:
+    """Merge PDFs by writing each source's objects to disk as soon as it is read.
+
+    Unlike PdfMerger, which holds the whole merged object graph until write(),
+    only one source document is in memory at a time. Once its pages are copied
+    the reader is dropped. Across sources, fonts, font descriptors, images and
+    other streams that serialize to identical bytes are written once and
+    shared, so repeated email fonts and logos do not grow the output. Memory
+    stays flat apart from the xref offsets, the page list and the digest table
+    for shared objects, which take a few bytes per object.
+    """
+
+    PAGES_NUMBER = 1
+    CATALOG_NUMBER = 2
+    SHARED_TYPES = ("/Font", "/FontDescriptor", "/ExtGState", "/Encoding")
+
+    def __init__(self, output_path: str):
+        self._stream = open(output_path, "wb")
+        self._stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._offsets = array("Q", [0, 0, 0])
+        self._pages = array("L")
+        self._shared: Dict[bytes, int] = {}
+        self.shared_hits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """Close the output without finishing it, after a failed append"""
+        self._stream.close()
+
+    def _allocate(self) -> int:
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+
+    def _write_object(self, number: int, data: bytes):
+        self._offsets[number] = self._stream.tell()
+        self._stream.write(b"%d 0 obj\n" % number)
+        self._stream.write(data)
+        self._stream.write(b"\nendobj\n")
+
+    def _write_value(self, value, out: BytesIO, memo: Dict):
+        if isinstance(value, IndirectObject):
+            out.write(b"%d 0 R" % self._copy_reference(value, memo))
+        elif isinstance(value, StreamObject):
+            out.write(b"<<\n")
+            for key, item in value.items():
+                if key != "/Length":
+                    key.write_to_stream(out, None)
+                    out.write(b" ")
+                    self._write_value(item, out, memo)
+                    out.write(b"\n")
+            out.write(b"/Length %d\n>>\nstream\n" % len(value._data))
+            out.write(value._data)
+            out.write(b"\nendstream")
+        elif isinstance(value, DictionaryObject):
+            out.write(b"<<\n")
+            for key, item in value.items():
+                key.write_to_stream(out, None)
+                out.write(b" ")
+                self._write_value(item, out, memo)
+                out.write(b"\n")
+            out.write(b">>")
+        elif isinstance(value, ArrayObject):
+            out.write(b"[")
+            for item in value:
+                out.write(b" ")
+                self._write_value(item, out, memo)
+            out.write(b" ]")
+        else:
+            value.write_to_stream(out, None)
+
+    def _copy_reference(self, reference: IndirectObject, memo: Dict) -> int:
+        """Copy the object behind a source reference and return its output object number"""
+        key = (reference.idnum, reference.generation)
+        entry = memo.get(key)
+        if isinstance(entry, _PendingObject):
+            # Reference cycle: the object is still being copied, so fix its number now
+            if entry.number is None:
+                entry.number = self._allocate()
+            return entry.number
+        if entry is not None:
+            return entry
+
+        pending = _PendingObject()
+        memo[key] = pending
+        value = reference.get_object()
+        out = BytesIO()
+        self._write_value(value, out, memo)
+        data = out.getvalue()
+
+        digest = None
+        if pending.number is None and (
+            isinstance(value, StreamObject)
+            or (isinstance(value, DictionaryObject) and value.get("/Type") in self.SHARED_TYPES)
+        ):
+            digest = hashlib.sha256(data).digest()
+            if digest in self._shared:
+                self.shared_hits += 1
+                memo[key] = self._shared[digest]
+                return memo[key]
+
+        number = pending.number if pending.number is not None else self._allocate()
+        self._write_object(number, data)
+        if digest is not None:
+            self._shared[digest] = number
+        memo[key] = number
+        return number
+
+    def append(self, pdf_path: str):
+        """Copy every page of pdf_path to the output, then release the source"""
+        reader = PdfReader(pdf_path)
+        if reader.is_encrypted:
+            reader.decrypt("")
+
+        memo: Dict = {}
+        pages = list(reader.pages)
+        # Number the pages first so links and annotations that point at them resolve
+        numbers = []
+        for page in pages:
+            number = self._allocate()
+            numbers.append(number)
+            if page.indirect_reference is not None:
+                reference = page.indirect_reference
+                memo[(reference.idnum, reference.generation)] = number
+
+        for page, number in zip(pages, numbers):
+            out = BytesIO()
+            out.write(b"<<\n")
+            for key, item in page.items():
+                if key != "/Parent":
+                    key.write_to_stream(out, None)
+                    out.write(b" ")
+                    self._write_value(item, out, memo)
+                    out.write(b"\n")
+            out.write(b"/Parent %d 0 R\n>>" % self.PAGES_NUMBER)
+            self._write_object(number, out.getvalue())
+            self._pages.append(number)
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer"""
+        if self._stream.closed:
+            return
+        kids = b" ".join(b"%d 0 R" % number for number in self._pages)
+        self._write_object(self.PAGES_NUMBER, b"<< /Type /Pages /Kids [ %s ] /Count %d >>" % (kids, len(self._pages)))
+        self._write_object(self.CATALOG_NUMBER, b"<< /Type /Catalog /Pages %d 0 R >>" % self.PAGES_NUMBER)
+
+        xref_offset = self._stream.tell()
+        self._stream.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self._offsets))
+        for offset in self._offsets[1:]:
+            self._stream.write(b"%010d 00000 n \n" % offset)
+        self._stream.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                           % (len(self._offsets), self.CATALOG_NUMBER, xref_offset))
+        self._stream.close()
+
+
+class EmailHeaders(NamedTuple):
+    path: str
+    message_id: str
+    related_ids: List[str]
+    tickets: List[str]
+    subject: str
+    date: Optional[datetime]
+
+
+class ConversationIndex:
+    """Group .eml files into conversations using their headers.
+
+    Two emails belong to the same conversation when one names the other in
+    In-Reply-To or References, or when their subjects carry the same ticket
+    number (help desks such as Zendesk put it there, e.g. "Re: 5389056 -
+    Problems Migrating"). Only the header block of each file is read.
+    """
+
+    MESSAGE_ID_PATTERN = re.compile(r'<[^<>\s]+>')
+    TICKET_PATTERN = re.compile(r'(?<![\d.])#?(\d{6,10})(?![\d.])')
+    REPLY_PREFIX_PATTERN = re.compile(r'^\s*((re|fwd?|aw|wg)\s*(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+    UNSAFE_FILENAME_PATTERN = re.compile(r'[\\/:*?"<>|\s]+')
+
+    def __init__(self, eml_dir: str):
+        self.eml_dir = eml_dir
+        self.emails: List[EmailHeaders] = [self._read_headers(path)
+                                           for path in sorted(glob.glob(os.path.join(eml_dir, "*.eml")))]
+        self.by_stem: Dict[str, EmailHeaders] = {os.path.splitext(os.path.basename(email.path))[0]: email
+                                                 for email in self.emails}
+
+    def _read_headers(self, path: str) -> EmailHeaders:
+        from email.parser import BytesHeaderParser
+        from email.utils import parsedate_to_datetime
+
+        with open(path, "rb") as f:
+            lines = []
+            for line in f:
+                if not line.strip():
+                    break
+                lines.append(line)
+        headers = BytesHeaderParser().parsebytes(b"".join(lines))
+
+        def ids(name: str) -> List[str]:
+            return self.MESSAGE_ID_PATTERN.findall(" ".join(str(value) for value in headers.get_all(name, [])))
+
+        message_ids = ids("Message-ID")
+        subject = " ".join(str(headers.get("Subject", "")).split())
+        try:
+            date = parsedate_to_datetime(str(headers.get("Date", "")))
+            if date.tzinfo is None:
+                date = date.replace(tzinfo=timezone.utc)
+        except (TypeError, ValueError, IndexError):
+            date = None
+        return EmailHeaders(path=path,
+                            message_id=message_ids[0] if message_ids else "",
+                            related_ids=ids("In-Reply-To") + ids("References"),
+                            tickets=self.TICKET_PATTERN.findall(subject),
+                            subject=subject,
+                            date=date)
+
+    def conversations(self) -> List[Tuple[str, List[EmailHeaders]]]:
+        """(name, emails oldest first) for every conversation, ordered by first message"""
+        parent: Dict[str, str] = {}
+
+        def find(node: str) -> str:
+            parent.setdefault(node, node)
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        def union(a: str, b: str):
+            parent[find(a)] = find(b)
+
+        for email in self.emails:
+            node = "file:" + email.path
+            find(node)
+            for message_id in [email.message_id] + email.related_ids:
+                if message_id:
+                    union(node, "id:" + message_id)
+            for ticket in email.tickets:
+                union(node, "ticket:" + ticket)
+
+        groups: Dict[str, List[EmailHeaders]] = {}
+        for email in self.emails:
+            groups.setdefault(find("file:" + email.path), []).append(email)
+
+        conversations = [sorted(group, key=self.sort_key) for group in groups.values()]
+        conversations.sort(key=lambda group: self.sort_key(group[0]))
+
+        named = []
+        used = set()
+        for group in conversations:
+            name = self._conversation_name(group)
+            unique, n = name, 2
+            while unique.lower() in used:
+                unique, n = f"{name} ({n})", n + 1
+            used.add(unique.lower())
+            named.append((unique, group))
+        return named
+
+    @staticmethod
+    def sort_key(email: EmailHeaders):
+        # Undated emails go last, as PDFSorterMerger does with filenames that carry no date
+        return (email.date is None, email.date or datetime.min.replace(tzinfo=timezone.utc),
+                os.path.basename(email.path))
+
+    def _conversation_name(self, group: List[EmailHeaders]) -> str:
+        tickets = [ticket for email in group for ticket in email.tickets]
+        subject = self.REPLY_PREFIX_PATTERN.sub("", re.sub(r'\[[^\]]*\]', "", group[0].subject))
+        if tickets:
+            ticket = min(set(tickets), key=tickets.index)
+            subject = re.sub(r'^[\s:#-]+|[\s:#-]+$', "", subject.replace(ticket, "").replace("#", ""))
+            subject = f"{ticket} {subject}"
+        name = self.UNSAFE_FILENAME_PATTERN.sub(" ", subject).strip(" .")[:120]
+        return name or os.path.splitext(os.path.basename(group[0].path))[0]
+
+
+def _merge_conversation(output_path: str, pdf_paths: List[str]) -> Tuple[str, int, int]:
+    """Merge one conversation's PDFs; run in a worker process"""
+    with atomic_output(output_path) as temp_path, StreamingPdfWriter(temp_path) as writer:
+        for pdf in pdf_paths:
+            writer.append(pdf)
+    return output_path, len(pdf_paths), writer.shared_hits
+
 
 class PDFSorterMerger:
     DATE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}T\d{2}_?\d{2,4}_?\d{2,4}[+-]\d{2}_\d{2})')
 
-    def __init__(self, input_path: str):
+    def __init__(self, input_path: str, eml_dir: Optional[str] = None):
         self.input_path = input_path
         self.pdf_files = self._get_pdf_files()
+        self.index = ConversationIndex(eml_dir) if eml_dir else None
 
     def _get_pdf_files(self) -> List[str]:
         if os.path.isdir(self.input_path):
@@ -42,10 +370,37 @@ class PDFSorterMerger:
         
         return date_str
 
+    def _date_from_filename(self, filename: str) -> Optional[datetime]:
+        """The filename's date as an aware datetime, or None if it has none"""
+        date_str = self._extract_date_from_filename(filename)
+        if not date_str:
+            return None
+        day, rest = date_str.split('T')
+        sign = '+' if '+' in rest else '-'
+        time_part, offset = rest.split(sign)
+        digits = re.sub(r'\D', "", time_part)
+        if len(digits) != 6:
+            return None
+        try:
+            return datetime.strptime(f"{day}T{digits}{sign}{offset.replace('_', '')}", "%Y-%m-%dT%H%M%S%z")
+        except ValueError:
+            return None
+
+    def _email_for_pdf(self, pdf: str) -> Optional[EmailHeaders]:
+        if self.index is None:
+            return None
+        return self.index.by_stem.get(os.path.splitext(os.path.basename(pdf))[0])
+
     def _sort_pdfs_by_date(self) -> List[Tuple[str, str]]:
         pdfs_with_dates = []
         for pdf in self.pdf_files:
-            date_str = self._extract_date_from_filename(os.path.basename(pdf))
+            email = self._email_for_pdf(pdf)
+            if email is not None and email.date is not None:
+                date = email.date
+            else:
+                date = self._date_from_filename(os.path.basename(pdf))
+            # Header and filename dates alike, normalised to UTC so that string order is time order
+            date_str = date.astimezone(timezone.utc).isoformat() if date is not None else ""
             pdfs_with_dates.append((pdf, date_str))
         
         print(f"\nFound {len(pdfs_with_dates)} PDF files:")
@@ -53,17 +408,17 @@ class PDFSorterMerger:
             filename = os.path.basename(pdf)
             print(f"  {filename} -> Date: {date_str if date_str else 'NO DATE'}")
         
-        # Sort by date string, empty dates go first
+        # Sort by date string, empty dates go last
         pdfs_with_dates.sort(key=lambda x: (x[1] == "", x[1]))
         
-        print(f"\nSorted order:")
+        print("\nSorted order:")
         for i, (pdf, date_str) in enumerate(pdfs_with_dates, 1):
             filename = os.path.basename(pdf)
             print(f"  {i:2d}. {filename} -> Date: {date_str if date_str else 'NO DATE'}")
         
         return pdfs_with_dates
 
-    def merge_pdfs(self, output_path: str):
+    def merge_pdfs(self, output_path: str, streaming: bool = True):
         # Ensure output directory exists
         output_dir = os.path.dirname(output_path)
         if output_dir and not os.path.exists(output_dir):
@@ -74,25 +429,100 @@ class PDFSorterMerger:
             output_path = os.path.join(output_path, "merged_emails.pdf")
         
         sorted_pdfs = self._sort_pdfs_by_date()
-        merger = PdfMerger()
-        
-        print(f"\nMerging PDFs in order:")
-        for i, (pdf, date_str) in enumerate(sorted_pdfs, 1):
-            filename = os.path.basename(pdf)
-            print(f"  {i:2d}. Adding: {filename}")
-            merger.append(pdf)
-        
-        merger.write(output_path)
-        merger.close()
+        with atomic_output(output_path) as temp_path:
+            merger = StreamingPdfWriter(temp_path) if streaming else PdfMerger()
+            try:
+                print("\nMerging PDFs in order:")
+                for i, (pdf, date_str) in enumerate(sorted_pdfs, 1):
+                    filename = os.path.basename(pdf)
+                    print(f"  {i:2d}. Adding: {filename}")
+                    merger.append(pdf)
+            except BaseException:
+                if streaming:
+                    merger.abort()
+                else:
+                    merger.close()
+                raise
+
+            if streaming:
+                merger.close()
+                print(f"\nShared {merger.shared_hits} duplicate fonts/images across inputs")
+            else:
+                merger.write(temp_path)
+                merger.close()
         print(f"\nSuccessfully merged {len(sorted_pdfs)} PDFs into {output_path}")
 
+    def merge_conversations(self, output_dir: str, max_workers: Optional[int] = None) -> List[str]:
+        """Write one merged PDF per conversation into output_dir, merging groups in parallel"""
+        if self.index is None:
+            raise ValueError("merge_conversations needs the folder of source .eml files (eml_dir)")
+        os.makedirs(output_dir, exist_ok=True)
+
+        pdfs_by_email = {}
+        unmatched = []
+        for pdf in self.pdf_files:
+            email = self._email_for_pdf(pdf)
+            if email is None:
+                unmatched.append(pdf)
+            else:
+                pdfs_by_email[email.path] = pdf
+
+        jobs = []
+        for name, emails in self.index.conversations():
+            pdfs = [pdfs_by_email[email.path] for email in emails if email.path in pdfs_by_email]
+            if pdfs:
+                jobs.append((os.path.join(output_dir, f"{name}.pdf"), pdfs))
+
+        print(f"\nFound {len(self.pdf_files)} PDF files in {len(jobs)} conversations:")
+        for output_path, pdfs in jobs:
+            print(f"  {os.path.basename(output_path)} <- {len(pdfs)} PDFs")
+        if unmatched:
+            print(f"\nSkipping {len(unmatched)} PDFs with no matching .eml in {self.index.eml_dir}:")
+            for pdf in unmatched:
+                print(f"  {os.path.basename(pdf)}")
+
+        written = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_merge_conversation, output_path, pdfs) for output_path, pdfs in jobs]
+            for future in futures:
+                try:
+                    output_path, count, shared = future.result()
+                except Exception as e:
+                    print(f"Error merging conversation: {e}")
+                    continue
+                written.append(output_path)
+                print(f"  Merged {count} PDFs into {output_path} ({shared} shared fonts/images)")
+
+        print(f"\nSuccessfully wrote {len(written)} of {len(jobs)} conversation PDFs to {output_dir}")
+        return written
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Sort and merge PDF files by date in filename.")
     parser.add_argument("--input", required=True, help="Input folder or comma-separated list of PDF files")
-    parser.add_argument("--output", required=True, help="Output merged PDF file path")
+    parser.add_argument("--output", required=True,
+                        help="Output merged PDF file path (a directory with --per-conversation)")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="Merge with PyPDF2's PdfMerger, holding the whole document in memory")
+    parser.add_argument("--eml-dir",
+                        help="Folder of the source .eml files; their headers give the sort order "
+                             "(default: the input folder with --per-conversation)")
+    parser.add_argument("--per-conversation", action="store_true",
+                        help="Write one PDF per conversation, grouped by Message-ID, In-Reply-To, "
+                             "References and ticket numbers in the subject")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Parallel merge processes for --per-conversation (default: CPU count)")
     args = parser.parse_args()
 
-    pdf_merger = PDFSorterMerger(args.input)
-    pdf_merger.merge_pdfs(args.output)
+    eml_dir = args.eml_dir
+    if args.per_conversation and not eml_dir:
+        if not os.path.isdir(args.input):
+            parser.error("--per-conversation with a list of PDFs needs --eml-dir")
+        eml_dir = args.input
+
+    pdf_merger = PDFSorterMerger(args.input, eml_dir=eml_dir)
+    if args.per_conversation:
+        pdf_merger.merge_conversations(args.output, max_workers=args.workers)
+    else:
+        pdf_merger.merge_pdfs(args.output, streaming=not args.in_memory)
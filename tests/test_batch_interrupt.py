@@ -0,0 +1,44 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "eml-to-pdf-render.py")
+
+PLAIN_EMAIL = (
+    b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Stop\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n\r\nHello\r\n"
+)
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="needs POSIX process groups")
+def test_ctrl_c_stops_process_engine_without_failures(tmp_path):
+    pytest.importorskip("playwright")
+    source = tmp_path / "in"
+    source.mkdir()
+    for index in range(400):
+        (source / f"m{index:03d}.eml").write_bytes(PLAIN_EMAIL)
+    output = tmp_path / "out"
+    journal = tmp_path / "journal.sqlite"
+
+    # A session of its own, so the signal below reaches the converter's
+    # process group as a terminal's Ctrl-C would, and not pytest
+    process = subprocess.Popen(
+        [sys.executable, SCRIPT, "--batch-pdf", str(source), "--engine", "processes", "--processes", "2",
+         "--lightweight", "--journal", str(journal), "--output-dir", str(output)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+    deadline = time.monotonic() + 30
+    while not (output.is_dir() and any(output.iterdir())) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    os.killpg(process.pid, signal.SIGINT)
+    assert process.wait(timeout=60) == 0
+
+    with sqlite3.connect(journal) as connection:
+        states = dict(connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+    assert states.get("done")
+    assert "failed" not in states
@@ -0,0 +1,48 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "eml-to-pdf-render.py")
+
+
+@pytest.fixture(scope="module")
+def render():
+    spec = importlib.util.spec_from_file_location("eml_to_pdf_render", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+PLAIN_EMAIL = (
+    b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Upper\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n\r\nHello\r\n"
+)
+
+
+@pytest.mark.parametrize("name", ["mail.eml", "MAIL.EML", "Mail.Eml"])
+def test_output_name_replaces_extension_case_insensitively(render, name):
+    assert render.get_output_path(name, ".pdf") == os.path.splitext(name)[0] + ".pdf"
+
+
+def test_batch_html_keeps_upper_case_email(render, tmp_path, monkeypatch):
+    source = tmp_path / "UPPER.EML"
+    source.write_bytes(PLAIN_EMAIL)
+    monkeypatch.chdir(tmp_path)
+
+    outputs = render.batch_convert_to_html(".")
+
+    assert source.read_bytes() == PLAIN_EMAIL
+    assert [os.path.basename(path) for path in outputs] == ["UPPER.html"]
+
+
+def test_batch_html_puts_mbox_members_beside_the_mbox(render, tmp_path, monkeypatch):
+    (tmp_path / "mail.mbox").write_bytes(b"From a@b Mon Jan  1 00:00:00 2024\n" + PLAIN_EMAIL.replace(b"\r\n", b"\n"))
+    monkeypatch.chdir(tmp_path)
+
+    outputs = render.batch_convert_to_html(".")
+
+    assert (tmp_path / "mail.mbox").is_file()
+    assert [os.path.normpath(path) for path in outputs] == [os.path.join("mail", "000001.html")]